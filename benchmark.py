@@ -0,0 +1,125 @@
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Tuple
+
+from comment_tree import ColumnarCommentTree, CommentTree, _generate_data
+from renderer import Renderer, d
+
+SAMPLE_TEXT = '\n'.join((
+    '= Release notes',
+    'Thanks @contributor for the **bold //nested// fix** :+1: and the __underlined__ --old-- ^^new^^ ~~sub~~ parts.',
+    '=|name|value|notes|',
+    '|alpha|1|plain cell|',
+    '|beta|2|**bold cell** :100:|',
+    '* first',
+    '** nested',
+    '# numbered',
+    '## nested',
+    '----',
+    'Inline {{{code // not italics}}} and an escaped \\*\\* sequence.',
+))
+
+def bench_renderer_threads(renderer: Renderer = d,
+                           thread_counts: Iterable[int] = (1, 2, 4, 8),
+                           renders: int = 4000,
+                           text: str = SAMPLE_TEXT) -> List[Tuple[int, float]]:
+    """Renders the same text with one shared renderer from thread pools of each size, returning renders/second."""
+    expected = renderer.parse(text)
+    results = []
+    for thread_count in thread_counts:
+        with ThreadPoolExecutor(thread_count) as executor:
+            start = time.perf_counter()
+            outputs = list(executor.map(renderer.parse, (text for _ in range(renders))))
+            elapsed = time.perf_counter() - start
+        if any(output != expected for output in outputs): raise AssertionError('Concurrent render mismatch')
+        results.append((thread_count, renders / elapsed))
+    return results
+
+def check_parallel_render(renderer: Renderer = d,
+                          text: str = SAMPLE_TEXT,
+                          copies: int = 200,
+                          start_method: str = 'spawn') -> None:
+    """Renders copies of text with parse_parallel in workers started by start_method, which have to unpickle the
+    renderer, and checks the output against parse."""
+    text = '\n\n'.join(text for _ in range(copies))
+    context = multiprocessing.get_context(start_method)
+    if renderer.parse_parallel(text, 2, len(text) // 8, context) != renderer.parse(text):
+        raise AssertionError(f'Parallel render mismatch with {start_method}')
+
+def check_columnar_parity(trials: int = 500, steps: int = 40, ids: int = 30, seed: int = 0) -> None:
+    """Applies the same random updates (new comments, edits, moves, comments waiting for a missing parent), deletions,
+    detaches and prunes to a CommentTree and a ColumnarCommentTree, and checks both give the same tree after each."""
+    def shape(tree) -> tuple:
+        return ([(comment['id'], comment['parent'], comment.get('score')) for comment in tree.iterate()],
+                [[comment['id'] for comment in level] for level in tree.group_by_level(None)],
+                json.loads(tree.__json__()))
+
+    rng = random.Random(seed)
+    for trial in range(trials):
+        tree, columnar = CommentTree(), ColumnarCommentTree()
+        for step in range(steps):
+            action, existing = rng.random(), list(tree.mapping)
+            if action < 0.55 or not existing:
+                comment = {'id': rng.randrange(ids), 'parent': rng.choice([None, -1, *range(ids)])}
+                comment['score'] = rng.random()
+                ancestor_id = comment['parent']
+                while ancestor_id in tree.mapping and ancestor_id != comment['id']:
+                    ancestor_id = tree.mapping[ancestor_id]['parent']
+                if ancestor_id == comment['id']: continue  # Would make a cycle
+                tree.update([dict(comment)])
+                columnar.update([dict(comment)])
+            elif action < 0.75:
+                comment_id = rng.choice(existing)
+                del tree[comment_id], columnar[comment_id]
+            elif action < 0.9:
+                comment_id = rng.choice(existing)
+                tree.detach(comment_id)
+                columnar.detach(comment_id)
+            else:
+                max_length = rng.randrange(len(existing) + 2)
+                tree.prune(max_length)
+                columnar.prune(max_length)
+            if shape(tree) != shape(columnar):
+                raise AssertionError(f'Columnar tree mismatch in trial {trial}, step {step}')
+
+def bench_copy_on_write(num_comments: int = 300000, writes: int = 200) -> dict:
+    """Milliseconds per update (median and worst) on a tree that was never copied, and right after each copy, as a
+    writer publishing a snapshot after every batch does; plus the time of the first copy and of the next ones."""
+    tree = CommentTree(_generate_data(num_comments, num_comments // 10, sort_by_score=False))
+    parents, results = list(tree.mapping), {}
+
+    def timed(action) -> float:
+        start = time.perf_counter()
+        action()
+        return (time.perf_counter() - start) * 1000
+
+    def write(i: int) -> None:
+        tree.update([{'id': f'w{i}', 'parent': parents[i * 7919 % len(parents)], 'score': i}])
+
+    plain = sorted(timed(lambda: write(i)) for i in range(writes))
+    results['first copy'] = timed(tree.copy)
+    copies = []
+    for i in range(writes, 2 * writes): copies.append(timed(lambda: tree.copy()) + timed(lambda: write(i)))
+    chunked = sorted(timed(lambda: write(i)) for i in range(2 * writes, 3 * writes))
+    copies.sort()
+    results['update'] = (plain[len(plain) // 2], plain[-1])
+    results['update, chunked'] = (chunked[len(chunked) // 2], chunked[-1])
+    results['copy and update'] = (copies[len(copies) // 2], copies[-1])
+    return results
+
+if __name__ == '__main__':
+    gil_enabled = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print(f'Python {sys.version.split()[0]}, GIL {"enabled" if gil_enabled else "disabled"}, {os.cpu_count()} CPUs')
+    results = bench_renderer_threads()
+    for thread_count, throughput in results:
+        print(f'{thread_count:>3} threads: {throughput:>10.0f} renders/s ({throughput / results[0][1]:.2f}x)')
+    check_parallel_render()
+    print('parallel render with spawn: ok')
+    check_columnar_parity()
+    print('columnar tree parity: ok')
+    for name, value in bench_copy_on_write().items(): print(f'{name}: {value}')
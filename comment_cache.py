@@ -0,0 +1,173 @@
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from sys import getsizeof
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from comment_tree import CommentTree, PrunedView, SiblingIndex, _ChunkedDict
+from utils.skiplist import IndexableSkiplist
+
+__all__ = ['CommentTreeCache', 'estimate_size']
+
+def _sampled(items: Iterable, count: int, sizer: Callable[[Any], int], samples: int) -> int:
+    """count times the average size of up to samples of the count items, spread over them"""
+    if not count: return 0
+    sample = list(itertools.islice(items, 0, None, max(1, count // samples)))
+    return sum(map(sizer, sample)) * count // len(sample)
+
+def _deep_size(value: Any) -> int:
+    """Size of a value with the tuples, lists and dicts in it (keys and values one level down)"""
+    if isinstance(value, dict): return getsizeof(value) + sum(getsizeof(k) + getsizeof(v) for k, v in value.items())
+    if isinstance(value, (tuple, list)): return getsizeof(value) + sum(map(_deep_size, value))
+    return getsizeof(value)
+
+def _skiplist_size(skiplist: IndexableSkiplist, samples: int) -> int:
+    if skiplist._keys is not None: return getsizeof(skiplist) + getsizeof(skiplist._keys)
+    def nodes():
+        node = skiplist._head.next[0]
+        while node is not None:
+            yield node
+            node = node.next[0]
+    node_size = lambda node: getsizeof(node) + getsizeof(node.next) + getsizeof(node.width)
+    return getsizeof(skiplist) + node_size(skiplist._head) + _sampled(nodes(), len(skiplist), node_size, samples)
+
+def _view_size(view: Any, samples: int) -> int:
+    if isinstance(view, SiblingIndex):
+        lists = view._lists
+        return (getsizeof(view._entries) + getsizeof(lists) +
+                _sampled(view._entries.items(), len(view._entries), _deep_size, samples) +
+                _sampled(lists.values(), len(lists), lambda skiplist: _skiplist_size(skiplist, samples), samples))
+    size = getsizeof(view._orders) + _sampled(view._orders.values(), len(view._orders), getsizeof, samples)
+    if isinstance(view, PrunedView): size += getsizeof(view.keep)
+    return size
+
+def _container_size(container: Any) -> int:
+    """Size of a dict, or of a chunked one (see CommentTree.copy) with its chunks, without keys and values"""
+    if not isinstance(container, _ChunkedDict): return getsizeof(container)
+    return (getsizeof(container) + getsizeof(container._chunks) + getsizeof(container._index) +
+            sum(map(getsizeof, container._chunks.values())) + sum(map(getsizeof, container._index)))
+
+def estimate_size(comment_tree: CommentTree, samples: int = 64) -> int:
+    """Approximate memory footprint of a tree in bytes: its containers, plus its comment count times the average size
+    of up to samples comments spread over the tree (each comment's dict, its values and its children dict), plus what
+    its journal, views, subtree index, aggregates and tombstones hold, sampled the same way.
+
+    The journal keeps up to 2 * journal_limit changes, so a journaled tree keeps growing after it was sized: resize it
+    as it changes (see ThreadPublisher's on_flush).
+    """
+    mapping, children = comment_tree.mapping, comment_tree.children
+    size = _container_size(mapping) + _container_size(children) + getsizeof(comment_tree._roots)
+    size += getsizeof(comment_tree._tombstones) + getsizeof(comment_tree._compaction)
+    size += _sampled(mapping.values(), len(mapping), lambda comment: getsizeof(comment) +
+                     getsizeof(children.get(comment['id'], {})) +
+                     sum(getsizeof(value) for key, value in comment.items() if key != 'children'), samples)
+    journal = comment_tree._journal
+    if journal is not None: size += getsizeof(journal) + _sampled(journal, len(journal), _deep_size, samples)
+    for view in comment_tree.views.values(): size += _view_size(view, samples)
+    index = comment_tree._subtree_index
+    if index is not None:
+        size += getsizeof(index.order) + getsizeof(index.labels) + getsizeof(index.nodes)
+        size += _sampled(index.labels, len(index.labels), getsizeof, samples)  # Labels outgrow the small int cache
+        size += _sampled(index.nodes.values(), len(index.nodes), _deep_size, samples)
+    aggregates = comment_tree._aggregates
+    if aggregates is not None:
+        size += getsizeof(aggregates.nodes) + _sampled(aggregates.nodes.values(), len(aggregates.nodes), _deep_size,
+                                                       samples)
+    return size
+
+class CommentTreeCache:
+    """Thread-safe LRU cache of CommentTrees, one per post, kept under max_bytes by evicting the least recently used.
+
+    Missing trees are built by loader(key), outside the lock, once per key however many threads ask for it at the same
+    time. A tree is sized once, by sizer, when it is added; after changing a cached tree a lot, call resize(key), or
+    pass on_flush=lambda: cache.resize(key) to the ThreadPublisher serving it. A tree larger than the whole budget is
+    returned without being cached.
+    """
+    def __init__(self,
+                 loader: Callable[[Any], CommentTree],
+                 max_bytes: int,
+                 sizer: Callable[[CommentTree], int] = estimate_size) -> None:
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.sizer = sizer
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()  # key -> (tree, size), least recently used first
+        self._loading = {}  # key -> Future of the load in progress
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> CommentTree:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            future, loading = self._loading.get(key), False
+            if future is None: future, loading = self._loading.setdefault(key, Future()), True
+        if not loading: return future.result()
+        try:
+            tree = self.loader(key)
+            size = self.sizer(tree)
+        except BaseException as e:
+            with self._lock: del self._loading[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._add(key, tree, size)
+        future.set_result(tree)
+        return tree
+
+    __getitem__ = get
+
+    def put(self, key: Any, comment_tree: CommentTree) -> None:
+        size = self.sizer(comment_tree)
+        with self._lock: self._add(key, comment_tree, size)
+
+    def _add(self, key: Any, comment_tree: CommentTree, size: int) -> None:
+        self._pop(key)
+        if size > self.max_bytes: return
+        self._entries[key] = (comment_tree, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _pop(self, key: Any) -> Optional[CommentTree]:
+        entry = self._entries.pop(key, None)
+        if entry is None: return None
+        self.bytes -= entry[1]
+        return entry[0]
+
+    def resize(self, key: Any) -> None:
+        """Re-estimates the size of a cached tree after it changed, evicting others if it grew past the budget"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return
+        size = self.sizer(entry[0])
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._entries.move_to_end(key)
+                self._add(key, entry[0], size)
+
+    def invalidate(self, key: Any) -> Optional[CommentTree]:
+        with self._lock: return self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'trees': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,175 @@
+import asyncio
+from collections import defaultdict
+from functools import partial
+from typing import Any, Callable, Iterable, Optional
+
+from comment_tree import _NEW, Comment, CommentTree
+
+__all__ = ['ThreadPublisher', 'Subscription']
+
+class Subscription:
+    """One subscriber's bounded queue of patches (see CommentTree.changes_since), read with async for. Iteration ends
+    when the subscription is closed or dropped for falling behind; a dropped client should reload the thread."""
+    def __init__(self, publisher: 'ThreadPublisher', comment_id: Any = None, queue_size: int = 64) -> None:
+        self.publisher = publisher
+        self.comment_id = comment_id
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = False
+        self.closed = False
+
+    def _push(self, message: dict) -> None:
+        try: self.queue.put_nowait(message)
+        except asyncio.QueueFull: self.publisher._drop(self)
+
+    def _end(self) -> None:
+        """Replaces whatever is queued with the end of iteration"""
+        while not self.queue.empty(): self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    def close(self) -> None:
+        if self.closed: return
+        self.closed = True
+        self.publisher.subscribers.discard(self)
+        self._end()
+
+    def __aiter__(self) -> 'Subscription':
+        return self
+
+    async def __anext__(self) -> dict:
+        message = await self.queue.get()
+        if message is None: raise StopAsyncIteration
+        return message
+
+class ThreadPublisher:
+    """Pushes a CommentTree's changes to asyncio subscribers of the whole thread or of one subtree.
+
+    Changes made through update, rescore, detach and delete (or followed by notify) are collected for window seconds
+    and sent as one patch per batch. The patch is filtered once per subscribed subtree, not once per subscriber, and
+    the same message object is queued for everyone. A subscriber whose queue is full is dropped, not waited for. A
+    batch that can't be expressed as a patch is sent as {'from', 'to', 'reset': True}, and clients reload the thread:
+    this happens after a prune, or a sort that rebuilds the tree, while in-place sorts come as order ops (see
+    changes_since).
+
+    Must be created in a coroutine on the event loop (or given loop) and used from its thread; other threads call
+    notify_threadsafe after changing the tree, or rescore_threadsafe. on_flush is called after each batch, e.g. to
+    resize the tree in a CommentTreeCache as its journal grows.
+    """
+    def __init__(self,
+                 comment_tree: CommentTree,
+                 window: float = 0.05,
+                 queue_size: int = 64,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 on_flush: Optional[Callable[[], None]] = None) -> None:
+        self.comment_tree = comment_tree
+        self.window = window
+        self.queue_size = queue_size
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+        self.on_flush = on_flush
+        self.subscribers = set()
+        self.version = comment_tree.start_journal()
+        self.batches = self.dropped = 0
+        self._pending = None
+
+    def subscribe(self, comment_id: Any = None, queue_size: Optional[int] = None) -> Subscription:
+        """Subscribes to changes of the whole thread, or of comment_id and its descendants"""
+        subscription = Subscription(self, comment_id, queue_size or self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def _drop(self, subscription: Subscription) -> None:
+        self.dropped += 1
+        subscription.dropped = True
+        subscription.close()
+
+    def update(self, comments: Iterable[Comment]) -> None:
+        self.comment_tree.update(comments)
+        self.notify()
+
+    def detach(self, comment_id: Any) -> None:
+        self.comment_tree.detach(comment_id)
+        self.notify()
+
+    def delete(self, comment_id: Any) -> None:
+        del self.comment_tree[comment_id]
+        self.notify()
+
+    def rescore(self, comment_id: Any, score: Any, **fields) -> None:
+        """Sets a comment's score, and any other fields, by updating it with a new dict, so that only the changed
+        fields are sent"""
+        comment = {k: v for k, v in self.comment_tree.mapping[comment_id].items() if k != 'children'}
+        self.update([{**comment, 'score': score, **fields}])
+
+    def rescore_threadsafe(self, comment_id: Any, score: Any, **fields) -> None:
+        self.loop.call_soon_threadsafe(partial(self.rescore, comment_id, score, **fields))
+
+    def notify(self) -> None:
+        """Schedules a flush at the end of the current window, if none is scheduled yet"""
+        if self._pending is None: self._pending = self.loop.call_later(self.window, self.flush)
+
+    def notify_threadsafe(self) -> None:
+        self.loop.call_soon_threadsafe(self.notify)
+
+    def flush(self) -> None:
+        """Sends everything changed since the last batch now"""
+        if self._pending is not None: self._pending.cancel()
+        self._pending = None
+        tree = self.comment_tree
+        if tree.version == self.version: return
+        patch = tree.changes_since(self.version)
+        if patch is None: patch = {'from': self.version, 'to': tree.version, 'reset': True}
+        self.version = tree.version
+        self.batches += 1
+        if self.on_flush is not None: self.on_flush()
+        topics = defaultdict(list)
+        for subscription in self.subscribers: topics[subscription.comment_id].append(subscription)
+        for comment_id, subscriptions in topics.items():
+            message = patch if comment_id is None or 'reset' in patch else self._filter(patch, comment_id)
+            if message is None: continue
+            for subscription in subscriptions: subscription._push(message)
+
+    def _filter(self, patch: dict, root_id: Any) -> Optional[dict]:
+        """The ops of patch about comments that were in root_id's subtree before the batch or are in it now. Where a
+        comment was before is read from the old_parent of its first update, remove or detach in the batch (or from the
+        descendants of a detach), or from the tree for comments the batch didn't move. A comment that left comes as an
+        update with a parent outside the subtree, or as a remove or detach. Nothing is in the subtree of a comment that
+        is not in the tree. An order op is kept when the parent whose children it reorders is kept."""
+        mapping, before = self.comment_tree.mapping, {}
+        for op in patch['ops']:
+            if op['op'] in ('update', 'remove', 'detach'):
+                before.setdefault(op['comment']['id'] if op['op'] == 'update' else op['id'], op.get('old_parent', _NEW))
+            for comment_id, parent_id in op.get('descendants', ()): before.setdefault(comment_id, parent_id)
+
+        def parent_now(comment_id: Any) -> Any:
+            comment = mapping.get(comment_id)
+            return _NEW if comment is None else comment['parent']
+
+        def membership(parent_of: Callable[[Any], Any]) -> Callable[[Any], bool]:
+            inside = {root_id: parent_of(root_id) is not _NEW}  # Replies of a removed root_id wait outside the tree
+
+            def in_subtree(comment_id: Any) -> bool:
+                chain = {}
+                while comment_id not in inside and comment_id not in chain:  # Stop at a cycle
+                    parent_id = parent_of(comment_id)
+                    if parent_id is _NEW: break
+                    chain[comment_id] = None
+                    comment_id = parent_id
+                result = inside.get(comment_id, False)
+                for visited in chain: inside[visited] = result
+                return result
+            return in_subtree
+
+        is_in = membership(parent_now)
+        was_in = membership(lambda comment_id: before[comment_id] if comment_id in before else parent_now(comment_id))
+        ops = []
+        for op in patch['ops']:
+            if op['op'] == 'order':  # The order of the roots only matters to whole-thread subscribers
+                if 'parent' in op and (is_in(op['parent']) or was_in(op['parent'])): ops.append(op)
+                continue
+            comment_id = op['comment']['id'] if op['op'] == 'update' else op['id']
+            if is_in(comment_id) or was_in(comment_id): ops.append(op)
+        return {**patch, 'ops': ops} if ops else None
+
+    def close(self) -> None:
+        if self._pending is not None: self._pending.cancel()
+        self._pending = None
+        for subscription in list(self.subscribers): subscription.close()
@@ -0,0 +1,214 @@
+import itertools
+import json
+import mmap
+import struct
+from array import array
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from comment_tree import ROOTS, Comment, CommentTree, Cursor, Page
+
+__all__ = ['CommentSnapshot', 'save']
+
+_header = struct.Struct('<4sIII')
+_magic = b'CTS1'
+
+def save(comment_tree: CommentTree,
+         path: str,
+         fields: Iterable[str] = ('score', 'created_utc'),
+         view: Optional[str] = None) -> int:
+    """Writes a read-only binary snapshot of the tree, in pre-order (in the order of view, if given), and returns its
+    size in bytes.
+
+    Layout after the header (magic, comment count, metadata length, id table length): one float64 column per field,
+    int32 parent position, subtree size and depth columns, uint32 id table offsets, the uint32 permutation sorting the
+    ids, then the JSON metadata (field names, parents of roots missing from the tree, positions of deleted comments
+    and the fields their placeholders get) and the JSON-encoded ids.
+    """
+    fields = tuple(fields)
+    children = comment_tree._children_getter(view)
+    comments, parents, depths = [], array('i'), array('i')
+    stack = [(-1, 0, comment) for comment in reversed(tuple(comment_tree._roots_of(view)))]
+    while stack:
+        parent, depth, comment = stack.pop()
+        position = len(comments)
+        comments.append(comment)
+        parents.append(parent)
+        depths.append(depth)
+        stack.extend((position, depth + 1, child) for child in reversed(tuple(children(comment))))
+    sizes = array('i', [1]) * len(comments)
+    for position in reversed(range(len(comments))):
+        if parents[position] != -1: sizes[parents[position]] += sizes[position]
+
+    ids = [json.dumps(comment['id']).encode() for comment in comments]
+    offsets, total = array('I', [0]), 0
+    for encoded in ids:
+        total += len(encoded)
+        offsets.append(total)
+    order = array('I', sorted(range(len(ids)), key=ids.__getitem__))
+    root_parents = {str(i): comment['parent'] for i, comment in enumerate(comments)
+                    if parents[i] == -1 and comment['parent'] is not None}
+    deleted = [i for i, comment in enumerate(comments) if comment_tree.is_deleted(comment['id'])]
+    meta = json.dumps({'fields': fields, 'root_parents': root_parents, 'deleted': deleted,
+                       'tombstone_fields': comment_tree.tombstone_fields}).encode()
+    id_table = b''.join(ids)
+
+    with open(path, 'wb') as file:
+        written = file.write(_header.pack(_magic, len(comments), len(meta), len(id_table)))
+        for name in fields: written += file.write(array('d', (c.get(name) or 0.0 for c in comments)).tobytes())
+        for column in (parents, sizes, depths, offsets, order): written += file.write(column.tobytes())
+        written += file.write(meta) + file.write(id_table)
+    return written
+
+class CommentSnapshot:
+    """Read-only CommentTree snapshot served straight from a memory-mapped file written by save (or
+    CommentTree.save).
+
+    Comments are addressed by their pre-order position. Columns are memoryviews over the mapping, so nothing is copied
+    or rebuilt on open. Looking up an id is a binary search over the sorted id table. Comment dicts ('id', 'parent'
+    and the saved fields, as floats, plus the placeholder fields for deleted comments) are only built for the comments
+    returned.
+    """
+    def __init__(self, data) -> None:
+        self._data = data
+        self._view = memoryview(data)
+        magic, self.count, meta_length, ids_length = _header.unpack_from(data)
+        if magic != _magic: raise ValueError(magic)
+        offset, count = _header.size, self.count
+
+        def column(format_: str, length: int) -> memoryview:
+            nonlocal offset
+            view = self._view[offset:offset + length * 4 * (2 if format_ == 'd' else 1)].cast(format_)
+            offset += view.nbytes
+            return view
+
+        self._columns = {}
+        meta_start = len(data) - ids_length - meta_length
+        meta = json.loads(bytes(self._view[meta_start:meta_start + meta_length]))
+        for name in meta['fields']: self._columns[name] = column('d', count)
+        self.parents, self.sizes, self.depths = column('i', count), column('i', count), column('i', count)
+        self._id_offsets, self._id_order = column('I', count + 1), column('I', count)
+        self._ids_start = meta_start + meta_length
+        self._root_parents = {int(i): parent for i, parent in meta['root_parents'].items()}
+        self._deleted = frozenset(meta.get('deleted', ()))
+        self._tombstone_fields = meta.get('tombstone_fields', {})
+        self.fields = tuple(meta['fields'])
+
+    @classmethod
+    def open(cls, path: str) -> 'CommentSnapshot':
+        with open(path, 'rb') as file: return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self) -> None:
+        for view in (*self._columns.values(), self.parents, self.sizes, self.depths, self._id_offsets,
+                     self._id_order, self._view):
+            view.release()
+        if isinstance(self._data, mmap.mmap): self._data.close()
+
+    def __enter__(self) -> 'CommentSnapshot':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _id_bytes(self, position: int) -> bytes:
+        start = self._ids_start
+        return bytes(self._view[start + self._id_offsets[position]:start + self._id_offsets[position + 1]])
+
+    def id(self, position: int) -> Any:
+        return json.loads(self._id_bytes(position))
+
+    def position(self, comment_id: Any) -> int:
+        """Pre-order position of a comment, by binary search over the sorted ids"""
+        key, order = json.dumps(comment_id).encode(), self._id_order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_bytes(order[middle]) < key: low = middle + 1
+            else: high = middle
+        if low == self.count or self._id_bytes(order[low]) != key: raise KeyError(comment_id)
+        return order[low]
+
+    def comment(self, position: int) -> Comment:
+        parent = self.parents[position]
+        comment = {'id': self.id(position),
+                   'parent': self.id(parent) if parent != -1 else self._root_parents.get(position)}
+        for name, values in self._columns.items(): comment[name] = values[position]
+        if position in self._deleted: comment.update(self._tombstone_fields)
+        return comment
+
+    def is_deleted(self, comment_id: Any) -> bool:
+        return self.position(comment_id) in self._deleted
+
+    def column(self, name: str) -> memoryview:
+        """Values of a field for every comment, in pre-order, without copying"""
+        return self._columns[name]
+
+    def _children(self, position: int) -> Iterator[int]:
+        """Positions of the children of position (of the roots, for -1)"""
+        child, stop = (0, self.count) if position == -1 else (position + 1, position + self.sizes[position])
+        while child < stop:
+            yield child
+            child += self.sizes[child]
+
+    def children(self, parent_id: Any) -> List[Comment]:
+        """Children of parent_id (or the roots, for ROOTS)"""
+        position = -1 if parent_id is ROOTS else self.position(parent_id)
+        return [self.comment(child) for child in self._children(position)]
+
+    def subtree_size(self, comment_id: Any) -> int:
+        return self.sizes[self.position(comment_id)]
+
+    def depth(self, comment_id: Any) -> int:
+        return self.depths[self.position(comment_id)]
+
+    def group_by_level(self, start_comment_id=None) -> Iterator[Tuple[Comment]]:
+        """Iterator returning list of comments grouped by depth/level"""
+        level = [self.position(start_comment_id)] if start_comment_id is not None else list(self._children(-1))
+        while level:
+            yield tuple(self.comment(position) for position in level)
+            level = [child for position in level for child in self._children(position)]
+
+    def iterate(self, start_comment_id=None) -> Iterator[Comment]:
+        """Pre-order iteration: a subtree is one contiguous run of positions"""
+        start = self.position(start_comment_id) if start_comment_id is not None else 0
+        stop = start + self.sizes[start] if start_comment_id is not None else self.count
+        for position in range(start, stop): yield self.comment(position)
+
+    def page(self,
+             cursor: Cursor = Cursor(ROOTS),
+             count: int = 20,
+             max_children: int = 10,
+             max_depth: int = 8) -> Page:
+        """Same comments as CommentTree.page, read from the snapshot (the more cursors come in pre-order)"""
+        parent = -1 if cursor.parent_id is ROOTS else self.position(cursor.parent_id)
+        top = list(itertools.islice(self._children(parent), cursor.offset, cursor.offset + count + 1))
+        more = [Cursor(cursor.parent_id, cursor.offset + count, cursor.depth)] if len(top) > count else []
+        comments, stack = [], [(cursor.depth, position) for position in reversed(top[:count])]
+        while stack:
+            depth, position = stack.pop()
+            comments.append((depth, self.comment(position)))
+            if depth + 1 >= cursor.depth + max_depth:
+                if self.sizes[position] > 1: more.append(Cursor(comments[-1][1]['id'], 0, depth + 1))
+                continue
+            kids = list(itertools.islice(self._children(position), max_children + 1))
+            if len(kids) > max_children: more.append(Cursor(comments[-1][1]['id'], max_children, depth + 1))
+            stack.extend((depth + 1, child) for child in reversed(kids[:max_children]))
+        return Page(comments, more)
+
+    def to_tree(self) -> CommentTree:
+        tree = CommentTree(self.iterate())
+        tree.tombstone(*(self.id(position) for position in sorted(self._deleted)))
+        return tree
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, comment_id: Any) -> bool:
+        try: self.position(comment_id)
+        except KeyError: return False
+        return True
+
+    def __getitem__(self, comment_id: Any) -> Comment:
+        return self.comment(self.position(comment_id))
+
+    def __iter__(self) -> Iterator[Comment]:
+        yield from self.iterate()
@@ -0,0 +1,267 @@
+import itertools
+import sqlite3
+from collections import ChainMap, Counter, defaultdict
+from typing import Any, Container, Iterable, Iterator, List, Optional, Tuple
+
+from comment_tree import ROOTS, Comment, CommentTree, Cursor, Page
+
+__all__ = ['CommentStore', 'SQLiteCommentStore', 'LazyCommentTree']
+
+class CommentStore:
+    """Where a LazyCommentTree fetches its comments from. Every method takes a batch of ids, so that a whole tree level
+    is one round trip."""
+    def fetch(self, comment_ids: List[Any]) -> Iterable[Comment]:
+        """Comments with the given ids, in any order"""
+        raise NotImplementedError
+
+    def children(self, parent_ids: List[Any], offset: int = 0, limit: Optional[int] = None) -> Iterable[Comment]:
+        """Comments whose parent is one of parent_ids, each parent's children in sibling order: from the offset-th on,
+        and at most limit of them (all of them, for None)"""
+        raise NotImplementedError
+
+    def with_children(self, parent_ids: List[Any]) -> set:
+        """The parent_ids that have at least one child"""
+        return {comment['parent'] for comment in self.children(parent_ids, 0, 1)}
+
+    def ancestors(self, comment_ids: List[Any], known: Container = ()) -> Iterator[Comment]:
+        """Comments with the given ids and all their ancestors, in any order, except those in known and above them: one
+        fetch per level up"""
+        missing, seen = [comment_id for comment_id in comment_ids if comment_id not in known], set()
+        while missing:
+            seen.update(missing)
+            comments = list(self.fetch(missing))
+            yield from comments
+            missing = [parent_id for parent_id in dict.fromkeys(comment['parent'] for comment in comments)
+                       if parent_id is not None and parent_id not in known and parent_id not in seen]
+
+class SQLiteCommentStore(CommentStore):
+    """Comments in a SQLite table with (at least) id and parent columns, indexed on parent. Rows become comment dicts
+    of all their columns; siblings are ordered by order_by (insertion order by default)."""
+    max_variables = 500  # Ids per IN (...) query, below SQLite's limit on bound parameters
+
+    def __init__(self, database, table: str = 'comments', order_by: str = 'rowid') -> None:
+        if not isinstance(database, sqlite3.Connection): database = sqlite3.connect(database, check_same_thread=False)
+        self.connection = database
+        self.connection.row_factory = sqlite3.Row
+        self.table = table
+        self.order_by = order_by
+        self.queries = 0
+
+    def create(self, fields: Iterable[str] = ('score', 'created_utc')) -> None:
+        columns = ''.join(f', {field}' for field in fields)
+        with self.connection:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (id PRIMARY KEY, parent{columns})')
+            self.connection.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_parent ON {self.table} (parent)')
+
+    def insert(self, comments: Iterable[Comment], fields: Iterable[str] = ('score', 'created_utc')) -> None:
+        """Adds or replaces comments, keeping id, parent and fields"""
+        columns = ('id', 'parent', *fields)
+        query = f'INSERT OR REPLACE INTO {self.table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        with self.connection:
+            self.connection.executemany(query, (tuple(c.get(column) for column in columns) for c in comments))
+
+    def _select(self,
+                column: str,
+                values: List[Any],
+                select: str = '*',
+                order_by: str = None,
+                offset: int = 0,
+                limit: Optional[int] = None) -> Iterator[Comment]:
+        """Rows whose column is one of values, in as few queries as the bound parameter limit allows. offset and limit
+        apply to the rows of each value, numbered in sibling order by a window function."""
+        values, order_by, batches = list(values), order_by or f'{column}, {self.order_by}', []
+        if None in values: batches.append((f'{column} IS NULL', []))
+        values = [value for value in values if value is not None]
+        for start in range(0, len(values), self.max_variables):
+            batch = values[start:start + self.max_variables]
+            batches.append((f'{column} IN ({", ".join("?" * len(batch))})', batch))
+        for condition, parameters in batches:
+            self.queries += 1
+            if not offset and limit is None:
+                query = f'SELECT {select} FROM {self.table} WHERE {condition} ORDER BY {order_by}'
+                yield from map(dict, self.connection.execute(query, parameters))
+                continue
+            upper = ' AND _position <= ?' if limit is not None else ''
+            query = (f'SELECT * FROM (SELECT {select}, ROW_NUMBER() OVER (PARTITION BY {column} '
+                     f'ORDER BY {self.order_by}) AS _position FROM {self.table} WHERE {condition}) '
+                     f'WHERE _position > ?{upper} ORDER BY {column}, _position')
+            window = [offset] if limit is None else [offset, offset + limit]
+            for row in self.connection.execute(query, parameters + window):
+                row = dict(row)
+                del row['_position']
+                yield row
+
+    def fetch(self, comment_ids: List[Any]) -> Iterable[Comment]:
+        return self._select('id', comment_ids)
+
+    def children(self, parent_ids: List[Any], offset: int = 0, limit: Optional[int] = None) -> Iterable[Comment]:
+        return self._select('parent', parent_ids, offset=offset, limit=limit)
+
+    def with_children(self, parent_ids: List[Any]) -> set:
+        return {row['parent'] for row in self._select('parent', parent_ids, 'DISTINCT parent', 'parent')}
+
+    def ancestors(self, comment_ids: List[Any], known: Container = ()) -> Iterator[Comment]:
+        """One recursive query per max_variables ids, however deep they are: known only saves the query when it
+        holds all of them"""
+        missing = [comment_id for comment_id in comment_ids if comment_id not in known]
+        table = self.table
+        for start in range(0, len(missing), self.max_variables):
+            batch = missing[start:start + self.max_variables]
+            self.queries += 1
+            query = (f'WITH RECURSIVE chain(id) AS (SELECT id FROM {table} WHERE id IN ({", ".join("?" * len(batch))}) '
+                     f'UNION SELECT {table}.parent FROM {table} JOIN chain ON {table}.id = chain.id) '
+                     f'SELECT * FROM {table} WHERE id IN (SELECT id FROM chain)')
+            yield from map(dict, self.connection.execute(query, batch))
+
+class LazyCommentTree(CommentTree):
+    """CommentTree backed by a CommentStore, holding only what was read so far.
+
+    page, group_by_level and iterate fetch the children they are about to visit in one store call per tree level, so
+    branches that are never visited are never loaded. page only fetches the first children of each group, as many as it
+    shows (all of them, with a view), and more as later pages need them; the others fetch whole sibling groups.
+    root_parent is the parent of the top-level comments in the store (the post). Changes made to the tree are not
+    written back.
+    """
+    chunk_size = 8  # First children fetched per sibling group by iterate
+    prefetch = 64  # Comments at one depth whose first children iterate fetches in one store call
+
+    def __init__(self,
+                 comments: Iterable[Comment] = None,
+                 tombstone_mode: Optional[bool] = None,
+                 store: Optional[CommentStore] = None,
+                 root_parent: Any = None) -> None:
+        self.store = store if store is not None else getattr(self, 'store', None)
+        self.root_parent = root_parent if store is not None else getattr(self, 'root_parent', root_parent)
+        self._loaded = getattr(self, '_loaded', set()) if comments is not None else set()  # Complete sibling groups
+        self._fetched = {}  # Parent id -> how many of its first children were fetched, for incomplete groups
+        super().__init__(comments, tombstone_mode)
+
+    def _load_comments(self, comment_ids: Iterable[Any]) -> None:
+        """Fetches comments by id, with their missing ancestors (see CommentStore.ancestors), so that everything loaded
+        hangs from root_parent"""
+        known = ChainMap(self.mapping, {self.root_parent: None})
+        missing = [comment_id for comment_id in dict.fromkeys(comment_ids) if comment_id not in known]
+        if not missing: return
+        self.update(comment for comment in self.store.ancestors(missing, known) if comment['id'] not in known)
+
+    def _load_children(self, parent_ids: List[Any], stop: Optional[int] = None, view: Optional[str] = None) -> None:
+        """Fetches the children of every parent in parent_ids (ROOTS for the top level) not fetched yet: the first stop
+        of them in sibling order, or all of them without stop or with a view (which has its own order). One store call
+        per number of children fetched before, usually one in all."""
+        if view is not None: stop = None
+        missing = defaultdict(list)  # Children fetched so far -> parents
+        for parent_id in dict.fromkeys(self.root_parent if p is ROOTS else p for p in parent_ids):
+            if self._unfetched(parent_id, stop): missing[self._fetched.get(parent_id, 0)].append(parent_id)
+        if not missing: return
+        self._load_comments(parent_id for parents in missing.values() for parent_id in parents
+                            if parent_id != self.root_parent)
+        for offset, parents in missing.items():
+            limit = None if stop is None else stop - offset
+            sizes = [len(self.children.get(parent_id, ())) for parent_id in parents]
+            fetched = list(self.store.children(parents, offset, limit))
+            self.update(comment for comment in fetched if comment['id'] not in self.mapping)
+            counts = Counter(comment['parent'] for comment in fetched)
+            for parent_id in parents:
+                if limit is None or counts[parent_id] < limit:
+                    self._loaded.add(parent_id)
+                    self._fetched.pop(parent_id, None)
+                else:
+                    self._fetched[parent_id] = offset + limit
+            if any(size != offset for size in sizes): self._reorder(parents, offset, fetched)
+
+    def _unfetched(self, parent_id: Any, stop: Optional[int]) -> bool:
+        """Whether any of the first stop children of parent_id (any of them, for None) remain to be fetched"""
+        return parent_id not in self._loaded and (stop is None or self._fetched.get(parent_id, 0) < stop)
+
+    def _reorder(self, parent_ids: List[Any], offset: int, fetched: List[Comment]) -> None:
+        """Puts the children just fetched right after the offset fetched before them, and any others (loaded earlier as
+        someone's ancestor, out of sibling order) after those"""
+        previous = self.sibling_orders([*parent_ids, ROOTS] if self.root_parent in parent_ids else parent_ids)
+        if self._owned is not None: self._own(*parent_ids)
+        for parent_id in parent_ids:
+            siblings = self.children.get(parent_id)
+            if not siblings: continue
+            fetched_here = [comment['id'] for comment in fetched if comment['parent'] == parent_id]
+            moved = set(fetched_here)
+            others = [comment_id for comment_id in itertools.islice(siblings, offset, None) if comment_id not in moved]
+            for comment_id in fetched_here + others:
+                siblings.move_to_end(comment_id)
+                if parent_id == self.root_parent: self._writable('_roots').move_to_end(comment_id)
+        self.order_changed(previous)
+        for view in self.views.values(): view.invalidate()
+
+    def _with_children(self, parent_ids: List[Any], view: Optional[str] = None) -> set:
+        """Asks the store about parents none of whose children were fetched, instead of fetching them"""
+        known = {parent_id for parent_id in parent_ids if parent_id in self._loaded or parent_id in self._fetched}
+        unknown = [parent_id for parent_id in parent_ids if parent_id not in known]
+        return super()._with_children(known, view) | (self.store.with_children(unknown) if unknown else set())
+
+    def load_subtree(self, comment_id: Any = None) -> None:
+        """Fetches a comment's whole subtree (the whole tree, for None), one store call per level"""
+        for _ in self.group_by_level(comment_id): pass
+
+    def page(self,
+             cursor: Cursor = Cursor(ROOTS),
+             count: int = 20,
+             max_children: int = 10,
+             max_depth: int = 8,
+             view: Optional[str] = None) -> Page:
+        if cursor.parent_id is not ROOTS: self._load_comments([cursor.parent_id])
+        return super().page(cursor, count, max_children, max_depth, view)
+
+    def group_by_level(self, start_comment_id=None, view: Optional[str] = None) -> Iterator[Tuple[Comment]]:
+        """Iterator returning list of comments grouped by depth/level, fetching each level before it is read"""
+        if start_comment_id is not None: self._load_comments([start_comment_id])
+        else: self._load_children([ROOTS])
+        children = self._children_getter(view)
+        queue = (self.mapping[start_comment_id],) if start_comment_id is not None else tuple(self._roots_of(view))
+        while queue:
+            yield tuple(map(self._shown, queue)) if self._tombstones else queue
+            self._load_children([comment['id'] for comment in queue])
+            queue = tuple(child for parent in queue for child in children(parent))
+
+    def _iterate(self, start_comment_id=None, view: Optional[str] = None) -> Iterator[Comment]:
+        """Pre-order iteration that fetches comments only as the traversal reaches them: each sibling group in chunks
+        that double in size from chunk_size, and the first chunk of a comment's children together with those of the
+        next prefetch comments listed at its depth, in one store call. Reaching a level thus takes one store call, not
+        one per sibling group in it. To iterate over a whole subtree, load_subtree it first: that takes one store call
+        per level."""
+        first = None if view is not None else self.chunk_size
+        unfetched = defaultdict(dict)  # Depth -> comments listed there, not visited yet, whose children weren't fetched
+        if start_comment_id is not None:
+            self._load_comments([start_comment_id])
+            stack = [[None, [self.mapping[start_comment_id]], 0, 0]]
+        else:
+            stack = [[ROOTS, [], 0, self.chunk_size]]
+        while stack:  # Sibling groups being visited: parent id, comments listed, position, next chunk (0 once complete)
+            level, depth = stack[-1], len(stack) - 1
+            parent_id, comments, position, chunk = level
+            if position == len(comments):
+                if not chunk:
+                    stack.pop()
+                    continue
+                stop = len(comments) + chunk
+                self._load_children([parent_id], stop, view)
+                listed = self._sibling_slice(parent_id, len(comments), stop, view)
+                comments.extend(listed)
+                unfetched[depth].update((c['id'], None) for c in listed if self._unfetched(c['id'], first))
+                level[3] = chunk * 2 if len(comments) == stop else 0
+                continue
+            level[2] += 1
+            comment = comments[position]
+            yield comment
+            unfetched[depth].pop(comment['id'], None)
+            if self._unfetched(comment['id'], first):
+                batch = [comment['id'], *itertools.islice(unfetched[depth], self.prefetch - 1)]
+                self._load_children(batch, self.chunk_size, view)
+                for prefetched in batch:
+                    unfetched[depth].pop(prefetched, None)
+                    unfetched[depth + 1].update((child_id, None) for child_id in self.children.get(prefetched, ())
+                                                if self._unfetched(child_id, first))
+            stack.append([comment['id'], [], 0, self.chunk_size])
+
+    def copy(self) -> 'LazyCommentTree':
+        tree = super().copy()
+        tree.store, tree.root_parent, tree._loaded = self.store, self.root_parent, self._loaded.copy()
+        tree._fetched = self._fetched.copy()
+        return tree
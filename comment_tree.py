@@ -1,82 +1,1017 @@
+import bisect
+import io
+import itertools
 import random
 import json
-from collections import defaultdict, deque, OrderedDict
-from typing import Any, Callable, Iterable, Iterator, List, MutableMapping, Tuple
+import math
+from array import array
+from collections import abc, defaultdict, deque, OrderedDict
+from typing import Any, Callable, Iterable, Iterator, List, MutableMapping, NamedTuple, Optional, Tuple
+from utils.skiplist import IndexableSkiplist
 
-__all__ = ['CommentTree']
+__all__ = ['CommentTree', 'ColumnarCommentTree', 'Cursor', 'Page', 'SiblingView', 'PrunedView', 'SiblingIndex',
+           'SubtreeIndex', 'SubtreeAggregates', 'Aggregate', 'ROOTS']
 
 Comment = MutableMapping[str, Any]
 
+class _Roots:
+    """Type of ROOTS, the parent key of the root level in sibling views and cursors"""
+    __slots__ = ()
+
+    def __repr__(self) -> str: return 'ROOTS'
+
+    def __reduce__(self) -> str: return 'ROOTS'
+
+ROOTS = _Roots()
+_NEW = object()  # Previous parent of a comment that was just added, in the journal
+
+class _ChunkedDict(abc.MutableMapping):
+    """Insertion-ordered dict kept in chunks of up to chunk_size entries, shared by its copies until they change them:
+    copy is O(n / chunk_size) and the first change to a chunk afterwards copies that chunk only. Keys are found through
+    a key -> chunk number index, itself split by hash into index_chunks chunks shared the same way. With
+    default_factory, a missing key read with [] is added, as in a defaultdict."""
+    chunk_size = 1024
+    index_chunks = 256
+
+    def __init__(self, items: Iterable = (), default_factory: Optional[Callable[[], Any]] = None) -> None:
+        self.default_factory = default_factory
+        self._chunks = {}  # Chunk number -> dict, in insertion order
+        self._index = [{} for _ in range(self.index_chunks)]  # Key -> chunk number, by key hash
+        self._owned, self._owned_index = set(), bytearray(b'\x01' * self.index_chunks)  # Not shared with a copy
+        self._last = self._next = self._size = 0
+        if not isinstance(items, abc.Mapping):
+            for key, value in items: self[key] = value
+            return
+        items, index, index_chunks = iter(items.items()), self._index, self.index_chunks
+        for number in itertools.count():  # A mapping has no duplicate keys, so it is copied a chunk at a time
+            chunk = dict(itertools.islice(items, self.chunk_size))
+            if not chunk: break
+            self._chunks[number], self._last, self._next = chunk, number, number + 1
+            self._owned.add(number)
+            for key in chunk: index[hash(key) % index_chunks][key] = number
+            self._size += len(chunk)
+
+    def copy(self) -> '_ChunkedDict':
+        other = self.__class__.__new__(self.__class__)
+        other.default_factory = self.default_factory
+        other._chunks, other._index = self._chunks.copy(), self._index.copy()
+        other._last, other._next, other._size = self._last, self._next, self._size
+        other._owned, other._owned_index = set(), bytearray(self.index_chunks)
+        self._owned, self._owned_index = set(), bytearray(self.index_chunks)
+        return other
+
+    def _chunk(self, number: int) -> dict:
+        """Chunk number, copied first if it is still shared"""
+        chunk = self._chunks[number]
+        if number not in self._owned:
+            chunk = self._chunks[number] = chunk.copy()
+            self._owned.add(number)
+        return chunk
+
+    def _index_chunk(self, key: Any) -> dict:
+        i = hash(key) % self.index_chunks
+        if not self._owned_index[i]:
+            self._index[i] = self._index[i].copy()
+            self._owned_index[i] = 1
+        return self._index[i]
+
+    def __getitem__(self, key: Any) -> Any:
+        number = self._index[hash(key) % self.index_chunks].get(key)
+        if number is not None: return self._chunks[number][key]
+        if self.default_factory is None: raise KeyError(key)
+        value = self[key] = self.default_factory()
+        return value
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        number = self._index[hash(key) % self.index_chunks].get(key)
+        return default if number is None else self._chunks[number][key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        number = self._index[hash(key) % self.index_chunks].get(key)
+        if number is None:
+            last = self._chunks.get(self._last)
+            if last is None or len(last) >= self.chunk_size:
+                self._last, self._next = self._next, self._next + 1
+                self._chunks[self._last] = {}
+                self._owned.add(self._last)
+            number = self._index_chunk(key)[key] = self._last
+            self._size += 1
+        self._chunk(number)[key] = value
+
+    def __delitem__(self, key: Any) -> None:
+        number = self._index_chunk(key).pop(key)
+        chunk = self._chunk(number)
+        del chunk[key]
+        self._size -= 1
+        if not chunk and number != self._last:
+            del self._chunks[number]
+            self._owned.discard(number)
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        if key not in self:
+            if default: return default[0]
+            raise KeyError(key)
+        value = self.get(key)
+        del self[key]
+        return value
+
+    def clear(self) -> None:
+        self.__init__(default_factory=self.default_factory)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._index[hash(key) % self.index_chunks]
+
+    def __iter__(self) -> Iterator[Any]:
+        return itertools.chain.from_iterable(self._chunks.values())
+
+    def __len__(self) -> int:
+        return self._size
+
+    def values(self) -> abc.ValuesView:
+        return _ChunkedValues(self)
+
+    def items(self) -> abc.ItemsView:
+        return _ChunkedItems(self)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({dict(self.items())!r})'
+
+class _ChunkedValues(abc.ValuesView):
+    def __iter__(self) -> Iterator[Any]:
+        return itertools.chain.from_iterable(chunk.values() for chunk in self._mapping._chunks.values())
+
+class _ChunkedItems(abc.ItemsView):
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        return itertools.chain.from_iterable(chunk.items() for chunk in self._mapping._chunks.values())
+
+class SiblingView:
+    """Named sibling ordering over a CommentTree, sorted lazily per parent and dropped again when that parent's
+    children change, so several orderings can be served from one tree without copying it."""
+    def __init__(self, comment_tree: 'CommentTree', key, descending=False) -> None:
+        self.comment_tree = comment_tree
+        self.key = key
+        self.descending = descending
+        self._orders = {}
+
+    def children(self, parent_id: Any) -> Tuple[Comment]:
+        """Children of parent_id (or the roots, for ROOTS) in this view's order"""
+        order = self._orders.get(parent_id)
+        if order is None:
+            tree = self.comment_tree
+            siblings = tree.output if parent_id is ROOTS else tree.children.get(parent_id, {})
+            order = CommentTreeSorter._sorted(siblings.values(), self.key, self.descending)
+            order = self._orders[parent_id] = tuple(order)
+        return order
+
+    def slice(self, parent_id: Any, start: int, stop: int) -> Tuple[Comment]:
+        return self.children(parent_id)[start:stop]
+
+    def added(self, parent_id: Any, comment: Comment) -> None:
+        self._orders.pop(parent_id, None)
+
+    def removed(self, parent_id: Any, comment: Comment) -> None:
+        self._orders.pop(parent_id, None)
+
+    def invalidate(self, *parent_ids: Any) -> None:
+        """Drops the cached order of each parent's children, e.g. after changing a sort field of one of them in place;
+        with no parent_ids, drops every cached order"""
+        if not parent_ids: self._orders.clear()
+        for parent_id in parent_ids: self._orders.pop(parent_id, None)
+
+class PrunedView(SiblingView):
+    """Non-destructive prune: the order of base_view (or of the tree itself) restricted to the comments in keep"""
+    def __init__(self, comment_tree: 'CommentTree', keep: set, base_view: Optional[str] = None) -> None:
+        super().__init__(comment_tree, None)
+        self.keep = keep
+        self.base_view = base_view
+
+    def children(self, parent_id: Any) -> Tuple[Comment]:
+        order = self._orders.get(parent_id)
+        if order is None:
+            siblings = self.comment_tree._siblings(parent_id, self.base_view)
+            order = self._orders[parent_id] = tuple(comment for comment in siblings if comment['id'] in self.keep)
+        return order
+
+class SiblingIndex:
+    """Order-statistic sibling ordering: every sibling group is kept in an IndexableSkiplist keyed by (ranking value,
+    id), so repositioning one comment, its rank among its siblings and the top k children all cost O(log n).
+
+    Register it with CommentTree.add_view to keep it current. After changing a comment's sort field in place, pass it
+    to CommentTree.update again to reposition it. descending negates the key, so it must be numeric in that case.
+    """
+    def __init__(self, comment_tree: 'CommentTree', key, descending=True) -> None:
+        self.comment_tree = comment_tree
+        self.key = key
+        self.descending = descending
+        self._lists = defaultdict(IndexableSkiplist)
+        self._entries = {}
+        self.invalidate()
+
+    def _entry(self, comment: Comment) -> Tuple[Any, Any]:
+        value = self.key(comment)
+        return -value if self.descending else value, comment['id']
+
+    def added(self, parent_id: Any, comment: Comment) -> None:
+        entry = self._entries[parent_id, comment['id']] = self._entry(comment)
+        self._lists[parent_id].insert(entry)
+
+    def removed(self, parent_id: Any, comment: Comment) -> None:
+        entry = self._entries.pop((parent_id, comment['id']), None)
+        if entry is None: return
+        self._lists[parent_id].remove(entry)
+        if not self._lists[parent_id]: del self._lists[parent_id]
+
+    def invalidate(self, *parent_ids: Any) -> None:
+        """Rebuilds the given sibling groups (all of them without parent_ids) from the tree"""
+        tree = self.comment_tree
+        if not parent_ids:
+            self._lists.clear()
+            self._entries.clear()
+            parent_ids = (ROOTS, *tree.children)
+        for parent_id in parent_ids:
+            for _, comment_id in self._lists.pop(parent_id, ()): del self._entries[parent_id, comment_id]
+            siblings = tree.output if parent_id is ROOTS else tree.children.get(parent_id, {})
+            for comment in siblings.values(): self.added(parent_id, comment)
+
+    def children(self, parent_id: Any) -> Tuple[Comment]:
+        mapping = self.comment_tree.mapping
+        return tuple(mapping[comment_id] for _, comment_id in self._lists.get(parent_id, ()))
+
+    def slice(self, parent_id: Any, start: int, stop: int) -> List[Comment]:
+        siblings, mapping = self._lists.get(parent_id), self.comment_tree.mapping
+        return [mapping[comment_id] for _, comment_id in siblings.islice(start, stop)] if siblings else []
+
+    def top(self, parent_id: Any, k: int) -> List[Comment]:
+        """First k children of parent_id (or of the roots, for ROOTS)"""
+        return self.slice(parent_id, 0, k)
+
+    def rank(self, comment_id: Any, parent_id: Any = None) -> int:
+        """Zero-based position of a comment among its siblings (among the roots, with parent_id=ROOTS)"""
+        if parent_id is None: parent_id = self.comment_tree[comment_id]['parent']
+        return self._lists[parent_id].index(self._entries[parent_id, comment_id])
+
+class Cursor(NamedTuple):
+    """Position to resume a page from: children of parent_id (ROOTS for the top level) from offset on, which sit at
+    depth in the tree"""
+    parent_id: Any
+    offset: int = 0
+    depth: int = 0
+
+class Page(NamedTuple):
+    comments: List[Tuple[int, Comment]]  # (depth, comment) in pre-order
+    more: List[Cursor]  # "load more" cursors for cut sibling lists and "continue this thread" cursors past max_depth
+
+class SubtreeIndex:
+    """Euler-tour index of a CommentTree in its own (pre-)order: every comment has an entry label, the label of the
+    last comment of its subtree, the subtree size and its depth, so ancestor checks are label comparisons and a subtree
+    is one contiguous slice of the pre-order.
+
+    Labels are spread out by GAP so that a new leaf gets a label between its neighbours without renumbering; the
+    labels are only rebuilt when a gap runs out. Adding a leaf and removing a subtree cost O(depth) plus one insert or
+    delete in the pre-order lists. Other structural changes (adoption, promotion, re-sorting) drop the index and it is
+    rebuilt on the next query.
+    """
+    GAP = 1 << 20
+
+    def __init__(self, comment_tree: 'CommentTree') -> None:
+        self.comment_tree = comment_tree
+        self.order = []
+        self.labels = []
+        self.nodes = {}  # comment id -> [entry label, last label of the subtree, subtree size, depth]
+        stack = [(0, comment) for comment in reversed(comment_tree.output.values())]
+        while stack:
+            depth, comment = stack.pop()
+            self.nodes[comment['id']] = [len(self.order) * self.GAP, 0, 1, depth]
+            self.order.append(comment['id'])
+            stack.extend((depth + 1, child) for child in reversed(comment_tree._siblings(comment['id'])))
+        for comment_id in reversed(self.order):
+            parent = self.nodes.get(comment_tree.mapping[comment_id]['parent'])
+            if parent is not None and parent is not self.nodes[comment_id]: parent[2] += self.nodes[comment_id][2]
+        self._relabel()
+
+    def _relabel(self) -> None:
+        self.labels = [i * self.GAP for i in range(len(self.order))]
+        for i, comment_id in enumerate(self.order):
+            node = self.nodes[comment_id]
+            node[0], node[1] = i * self.GAP, (i + node[2] - 1) * self.GAP
+
+    def _ancestors(self, comment_id: Any) -> Iterator[list]:
+        mapping, nodes = self.comment_tree.mapping, self.nodes
+        comment = mapping.get(mapping[comment_id]['parent'])
+        while comment is not None and comment['id'] in nodes:
+            yield nodes[comment['id']]
+            comment = mapping.get(comment['parent'])
+
+    def add_leaf(self, comment: Comment) -> None:
+        """Adds a comment without children as the last child of its parent (or as the last root)"""
+        parent = self.nodes.get(comment['parent'])
+        if parent is None and comment['parent'] in self.comment_tree.mapping: return  # Parent is part of a cycle
+        if parent is not None:
+            position, depth = bisect.bisect_right(self.labels, parent[1]), parent[3] + 1
+        else:
+            position, depth = len(self.order), 0
+        previous_label = self.labels[position - 1] if position else -self.GAP
+        next_label = self.labels[position] if position < len(self.labels) else previous_label + 2 * self.GAP
+        if next_label - previous_label < 2:
+            self._relabel()
+            previous_label = self.labels[position - 1] if position else -self.GAP
+            next_label = self.labels[position] if position < len(self.labels) else previous_label + 2 * self.GAP
+        label = (previous_label + next_label) // 2
+        self.order.insert(position, comment['id'])
+        self.labels.insert(position, label)
+        self.nodes[comment['id']] = [label, label, 1, depth]
+        for ancestor in self._ancestors(comment['id']):
+            ancestor[2] += 1
+            if ancestor[1] == previous_label: ancestor[1] = label
+
+    def remove_subtree(self, comment_id: Any) -> List[Any]:
+        """Removes a comment and its descendants from the index and returns their ids in pre-order"""
+        node = self.nodes[comment_id]
+        start = bisect.bisect_left(self.labels, node[0])
+        stop = start + node[2]
+        removed = self.order[start:stop]
+        for ancestor in self._ancestors(comment_id):
+            ancestor[2] -= node[2]
+            if ancestor[1] == node[1]: ancestor[1] = self.labels[start - 1]
+        del self.order[start:stop], self.labels[start:stop]
+        for removed_id in removed: del self.nodes[removed_id]
+        return removed
+
+    def is_ancestor(self, ancestor_id: Any, comment_id: Any) -> bool:
+        ancestor, node = self.nodes[ancestor_id], self.nodes[comment_id]
+        return ancestor[0] < node[0] <= ancestor[1]
+
+    def subtree(self, comment_id: Any) -> List[Any]:
+        """Ids of a comment and its descendants, in pre-order"""
+        node = self.nodes[comment_id]
+        start = bisect.bisect_left(self.labels, node[0])
+        return self.order[start:start + node[2]]
+
+    def subtree_size(self, comment_id: Any) -> int:
+        return self.nodes[comment_id][2]
+
+    def depth(self, comment_id: Any) -> int:
+        return self.nodes[comment_id][3]
+
+class Aggregate(NamedTuple):
+    """Aggregates over a comment's descendants; max_score and latest_created are None without descendants"""
+    descendants: int
+    max_score: Optional[float]
+    latest_created: Optional[float]
+
+class SubtreeAggregates:
+    """Descendant count, highest descendant score and latest descendant creation time of every comment, kept current
+    as comments are added, moved, rescored and removed by walking up the ancestors of the change only.
+
+    Counts are adjusted on the way up. A maximum is only recomputed, from the ancestor's children, when the value
+    removed was that maximum, so each change costs O(depth) plus the sibling groups of those ancestors. Comments
+    missing a field don't count towards its maximum. Only comments reachable from the roots have aggregates; a change
+    that makes a comment unreachable (a parent cycle) or may make one reachable again drops the aggregates instead.
+
+    Every node also keeps the comment's own score and creation time as last counted, so that what a changed comment
+    used to contribute is known even when its dict was edited in place before being passed to update.
+    """
+    def __init__(self, comment_tree: 'CommentTree', score_field: str = 'score', created_field: str = 'created_utc'):
+        self.comment_tree = comment_tree
+        self.score_field = score_field
+        self.created_field = created_field
+        comments = list(comment_tree._iterate())
+        self.nodes = {comment['id']: [0, -math.inf, -math.inf, *self._own_values(comment)] for comment in comments}
+        for comment in reversed(comments):
+            parent = self.nodes.get(comment['parent'])
+            if parent is not None: self._fold(parent, self.contribution(comment['id']))
+
+    def _value(self, comment: Comment, field: str) -> float:
+        value = comment.get(field)
+        return -math.inf if value is None else value
+
+    def _own_values(self, comment: Comment) -> Tuple[float, float]:
+        return self._value(comment, self.score_field), self._value(comment, self.created_field)
+
+    @staticmethod
+    def _fold(node: list, contribution: Tuple[int, float, float]) -> None:
+        node[0] += contribution[0]
+        if contribution[1] > node[1]: node[1] = contribution[1]
+        if contribution[2] > node[2]: node[2] = contribution[2]
+
+    def _ancestors(self, parent_id: Any) -> Iterator[Tuple[Any, list]]:
+        mapping = self.comment_tree.mapping
+        while parent_id in mapping:
+            yield parent_id, self.nodes[parent_id]
+            parent_id = mapping[parent_id]['parent']
+
+    def contribution(self, comment_id: Any) -> Tuple[int, float, float]:
+        """What a comment and its descendants add to each of its ancestors, from its last stored values"""
+        count, max_score, latest, score, created = self.nodes[comment_id]
+        return count + 1, max(max_score, score), max(latest, created)
+
+    def store(self, comment: Comment) -> None:
+        """Stores the current score and creation time of a comment, before its ancestors are recomputed"""
+        self.nodes[comment['id']][3:] = self._own_values(comment)
+
+    def compute(self, comment_id: Any) -> None:
+        """Recomputes a comment's aggregates from its children (storing its own values if it's new)"""
+        node = self.nodes.get(comment_id)
+        own = node[3:] if node is not None else self._own_values(self.comment_tree.mapping[comment_id])
+        node = self.nodes[comment_id] = [0, -math.inf, -math.inf, *own]
+        for child in self.comment_tree._siblings(comment_id): self._fold(node, self.contribution(child['id']))
+
+    def add(self, comment: Comment) -> bool:
+        """Adds a comment that was just inserted under its parent, with its descendants, to its ancestors. Returns
+        False, without adding it, if the comment isn't reachable from the roots."""
+        mapping, chain, parent_id = self.comment_tree.mapping, [], comment['parent']
+        while parent_id in mapping:
+            if parent_id == comment['id'] or parent_id not in self.nodes: return False
+            chain.append(self.nodes[parent_id])
+            parent_id = mapping[parent_id]['parent']
+        contribution = self.contribution(comment['id'])
+        for node in chain: self._fold(node, contribution)
+        return True
+
+    def subtract(self, parent_id: Any, contribution: Tuple[int, float, float]) -> None:
+        """Removes a contribution, taken before the comment left parent_id, from parent_id and its ancestors"""
+        for ancestor_id, node in self._ancestors(parent_id):
+            count = node[0] - contribution[0]
+            if contribution[1] >= node[1] or contribution[2] >= node[2]: self.compute(ancestor_id)
+            node = self.nodes[ancestor_id]
+            node[0] = count
+
+    def pop(self, comment_id: Any) -> None:
+        self.nodes.pop(comment_id, None)
+
+    def __getitem__(self, comment_id: Any) -> Aggregate:
+        count, max_score, latest = self.nodes[comment_id][:3]
+        return Aggregate(count, max_score if max_score != -math.inf else None, latest if latest != -math.inf else None)
+
 class CommentTree:
-    """Nested list of dicts representing a comment tree."""
-    def __init__(self, comments: Iterable[Comment] = None) -> None:
+    """Nested list of dicts representing a comment tree.
+
+    In tombstone_mode, del and detach only mark comments as deleted (see tombstone) and compact removes them later.
+    iterate, group_by_level, page, context, the serializers and repr show a deleted comment as its placeholder, but
+    output, mapping and tree[comment_id] hold it as it was: check is_deleted before showing comments read from those.
+    With start_journal, every change is numbered and kept, up to journal_limit of them, for changes_since.
+    """
+    tombstone_fields = {'author': '[deleted]', 'body': '[deleted]'}  # Serialized in place of a deleted comment's fields
+    journal_limit = 100000
+
+    def __init__(self, comments: Iterable[Comment] = None, tombstone_mode: Optional[bool] = None) -> None:
+        self.tombstone_mode = getattr(self, 'tombstone_mode', False) if tombstone_mode is None else tombstone_mode
+        tombstones = getattr(self, '_tombstones', ())
+        journal, self._journal = getattr(self, '_journal', None), None  # Re-initialisation is journaled as one reset
+        self.version = getattr(self, 'version', 0)
+        self._tombstones, self._compaction = set(), deque()
         self.mapping = OrderedDict()
         self.children = defaultdict(OrderedDict)
-        self._output = OrderedDict()
+        self._roots = OrderedDict()
+        self._subtree_index = None
+        self._aggregates = None
+        self._shared, self._owned = set(), None  # See copy
+        self.views = getattr(self, 'views', OrderedDict())  # Views survive re-initialisation by prune, clear and sorts
+        for view in self.views.values(): view.invalidate()
         if comments is not None: self.update(comments)
+        self.tombstone(*(comment_id for comment_id in tombstones if comment_id in self.mapping))
+        self._journal = journal
+        if journal is not None: self._record('reset')
 
     def update(self, comments: Iterable[Comment]) -> None:
         for comment in comments:
-            self.mapping[comment['id']] = comment
-            comment['children'] = self.children[comment['id']]
-            self.children[comment['parent']][comment['id']] = comment
-        self._output = None
+            comment_id, parent_id = comment['id'], comment['parent']
+            previous = self.mapping.get(comment_id)
+            if self._owned is not None: self._own(parent_id, previous['parent'] if previous is not None else parent_id)
+            aggregates = self._aggregates
+            if aggregates is not None and previous is not None:
+                if comment_id in aggregates.nodes: contribution = aggregates.contribution(comment_id)
+                else: aggregates = self._aggregates = None  # Unreachable until now, may become reachable again
+            if previous is not None:
+                if previous['parent'] != parent_id: self.children[previous['parent']].pop(comment_id, None)
+                if self.views: self._notify_views('removed', previous)
+            self.mapping[comment_id] = comment
+            comment['children'] = self.children[comment_id]
+            self.children[parent_id][comment_id] = comment
+            if parent_id in self.mapping:
+                if comment_id in self._roots: self._writable('_roots').pop(comment_id)
+            elif self._roots.get(comment_id) is not comment: self._writable('_roots')[comment_id] = comment
+            if self.views: self._notify_views('added', comment)
+            if previous is None:
+                for child_id in comment['children']:
+                    if child_id not in self._roots: continue
+                    child = self._writable('_roots').pop(child_id)
+                    if self.views: self._notify_views('removed', child, roots_only=True)
+            if self._subtree_index is not None:
+                if previous is None and not comment['children']: self._subtree_index.add_leaf(comment)
+                elif previous is None or previous['parent'] != parent_id: self._subtree_index = None
+            if aggregates is not None:
+                if previous is not None:
+                    aggregates.store(comment)
+                    aggregates.subtract(previous['parent'], contribution)
+                else:
+                    aggregates.compute(comment_id)
+                if not aggregates.add(comment): self._aggregates = None
+            if self._journal is not None:
+                if previous is None or previous is comment or previous['parent'] != parent_id:
+                    # A dict changed in place can't be diffed against itself, so it is resent whole
+                    self._record('update', comment_id, {k: v for k, v in comment.items() if k != 'children'},
+                                 _NEW if previous is None else previous['parent'])
+                else:
+                    fields = {k: v for k, v in comment.items() if k != 'children' and previous.get(k, comment) != v}
+                    removed = [k for k in previous if k not in comment]
+                    if fields or removed: self._record('fields', comment_id, (fields, removed))
+
+    @classmethod
+    def from_jsonl(cls,
+                   source,
+                   fields: Optional[Iterable[str]] = None,
+                   root_parent: Any = None) -> Tuple['CommentTree', int]:
+        """The tree of a JSONL file, see load_jsonl, and how many of its comments are left waiting for a parent other
+        than root_parent that never arrived"""
+        tree = cls()
+        return tree, tree.load_jsonl(source, fields, root_parent)
+
+    def load_jsonl(self, source, fields: Optional[Iterable[str]] = None, root_parent: Any = None) -> int:
+        """Adds comments from a JSONL file (path or open file) or an iterable of lines or records in one pass, one
+        record at a time, and returns how many are left waiting for a parent that never arrived.
+
+        Records may come in any order: a comment whose parent hasn't been seen yet is held as a root until it arrives
+        and adopts it. With fields, only those keys (plus 'id' and 'parent') of each record are kept.
+        """
+        if isinstance(source, str):
+            with open(source, encoding='utf-8') as file: return self.load_jsonl(file, fields, root_parent)
+        keys = None if fields is None else {'id', 'parent', *fields}
+        records = (json.loads(line) if isinstance(line, (str, bytes)) else line for line in source
+                   if not isinstance(line, (str, bytes)) or line.strip())
+        if keys is not None: records = ({k: v for k, v in record.items() if k in keys} for record in records)
+        self.update(records)
+        return len(self.orphans(root_parent))
+
+    def orphans(self, root_parent: Any = None) -> List[Comment]:
+        """Roots whose parent is not root_parent and not in the tree (yet)"""
+        return [comment for comment in self._roots.values() if comment['parent'] != root_parent]
 
     @property
     def output(self) -> OrderedDict:
-        """Returns comment tree as a nested list of dicts"""
-        if self._output is not None: return self._output  # DEBUG: comment this line out for line profiling
-        result, cache = OrderedDict(), set()
-        for comment in self.mapping.values():
-            while comment['id'] not in cache:
-                cache.add(comment['id'])
-                if comment['parent'] not in self.mapping:
-                    result[comment['id']] = comment
-                    break
-                comment = self.mapping[comment['parent']]
-        self._output = result
-        return result
+        """Returns comment tree as a nested list of dicts.
+
+        The roots (comments whose parent is not in the tree) are maintained as comments are added and removed, in the
+        order they became roots; a parent arriving after its children replaces them at the end. Deleted comments are in
+        it as they were, not as their placeholder (see is_deleted).
+        """
+        return self._roots
 
     def detach(self, comment_id: Any) -> None:
-        """Detach a comment and all its descendants from the tree"""
+        """Detach a comment and all its descendants from the tree (mark them deleted, in tombstone_mode)"""
         if comment_id is None: return self.clear()
-        for comment in self.iterate(comment_id): del self[comment['id']]
-        self._output = None
+        if self.tombstone_mode: return self.tombstone(*(comment['id'] for comment in self._iterate(comment_id)))
+        self._detach(comment_id)
 
-    def prune(self, max_length: int) -> None:
-        """Prune the comment tree up to max_length, choosing only the top-most comments and their ancestors."""
-        if max_length <= 0: self.clear()
-        elif max_length >= len(self.mapping): return
-
-        new_mapping = {}
-        for comment in self.mapping.values():
-            temp = {}
-            while comment['id'] not in new_mapping and comment['id'] not in temp:
-                temp[comment['id']] = comment
-                if comment['parent'] not in self.mapping: break
-                comment = self.mapping[comment['parent']]
-            if len(new_mapping) + len(temp) > max_length: break
-            new_mapping.update(temp)
-        self.__init__(v for k, v in self.mapping.items() if k in new_mapping)
-
-    def copy(self) -> 'CommentTree': pass
+    def _detach(self, comment_id: Any) -> None:
+        if self._subtree_index is not None and comment_id in self._subtree_index.nodes:
+            comments = [self.mapping[i] for i in self._subtree_index.remove_subtree(comment_id)]
+        else:
+            comments = list(self._iterate(comment_id))
+        aggregates = self._aggregates
+        if aggregates is not None and comment_id in aggregates.nodes:
+            contribution = aggregates.contribution(comment_id)
+        else:
+            aggregates = None
+        for comment in reversed(comments): self._discard(comment)
+        if aggregates is not None: aggregates.subtract(comments[0]['parent'], contribution)
+        if self._journal is not None:
+            descendants = [[comment['id'], comment['parent']] for comment in comments[1:]]
+            self._record('detach', comment_id, descendants, comments[0]['parent'])
+
+    def prune(self, max_length: int, as_view: Optional[str] = None, base_view: Optional[str] = None):
+        """Prune the comment tree up to max_length, choosing only the top-most comments and their ancestors.
+
+        Comments are dropped in place, without rebuilding the tree. With as_view, nothing is dropped and a PrunedView
+        of base_view (or of the tree's own order) showing only the chosen comments is added under that name instead.
+        """
+        keep = self._prune_keep(max_length)
+        if as_view is not None:
+            view = self.views[as_view] = PrunedView(self, keep, base_view)
+            return view
+        if len(keep) == len(self.mapping): return
+        if not keep: return self.clear()
+        self._subtree_index = self._aggregates = None
+        for comment in [comment for comment_id, comment in self.mapping.items() if comment_id not in keep]:
+            self._discard(comment)
+        if self._journal is not None: self._record('reset')
+
+    def _prune_keep(self, max_length: int) -> set:
+        """Ids of the first comments in insertion order, with their ancestors, up to max_length. Each comment is only
+        walked over once, since the walk up stops at the first ancestor already kept."""
+        if max_length >= len(self.mapping): return set(self.mapping)
+        keep, mapping = set(), self.mapping
+        if max_length <= 0: return keep
+        for comment in mapping.values():
+            chain = []
+            while comment is not None and comment['id'] not in keep:
+                keep.add(comment['id'])
+                chain.append(comment['id'])
+                comment = mapping.get(comment['parent'])
+            if len(keep) > max_length:
+                keep.difference_update(chain)
+                break
+        return keep
+
+    def _discard(self, comment: Comment) -> None:
+        """Removes a comment whose descendants are all being removed as well, so none of them become roots"""
+        comment_id, parent_id = comment['id'], comment['parent']
+        if self._owned is not None: self._own(parent_id)
+        if self.views: self._notify_views('removed', comment)
+        siblings = self.children.get(parent_id)
+        if siblings is not None:
+            siblings.pop(comment_id, None)
+            if not siblings and parent_id not in self.mapping: del self.children[parent_id]
+        self.children.pop(comment_id, None)
+        del self.mapping[comment_id]
+        if comment_id in self._roots: self._writable('_roots').pop(comment_id)
+        if self._aggregates is not None: self._aggregates.pop(comment_id)
+        self._removed(comment_id, parent_id)
+
+    def _removed(self, comment_id: Any, parent_id: Any) -> None:
+        """Forgets a physically removed comment's tombstone, and queues its parent for compaction if it's a tombstone
+        left without children"""
+        if comment_id in self._tombstones: self._writable('_tombstones').discard(comment_id)
+        if parent_id in self._tombstones and not self.children.get(parent_id):
+            self._writable('_compaction').append(parent_id)
+
+    def tombstone(self, *comment_ids: Any) -> None:
+        """Marks comments as deleted in O(1) each, leaving the structure as it is: they keep their place, so their
+        replies stay visible under a placeholder, until compact removes the ones without replies"""
+        for comment_id in comment_ids:
+            if comment_id not in self.mapping: raise KeyError(comment_id)
+            self._writable('_tombstones').add(comment_id)
+            if not self.children.get(comment_id): self._writable('_compaction').append(comment_id)
+            if self._journal is not None: self._record('tombstone', comment_id)
+
+    def restore(self, comment_id: Any) -> None:
+        if comment_id in self._tombstones: self._writable('_tombstones').discard(comment_id)
+        if self._journal is not None: self._record('restore', comment_id)
+
+    def is_deleted(self, comment_id: Any) -> bool:
+        return comment_id in self._tombstones
+
+    @property
+    def pending_compaction(self) -> int:
+        return len(self._compaction)
+
+    def compact(self, limit: Optional[int] = None) -> int:
+        """Physically removes up to limit deleted comments without replies (all of them, without limit) and returns how
+        many were removed. A deleted parent left without replies is queued in turn; deleted comments that still have
+        replies stay as placeholders."""
+        removed, compaction = 0, self._writable('_compaction')
+        while compaction and (limit is None or removed < limit):
+            comment_id = compaction.popleft()
+            if comment_id not in self._tombstones or self.children.get(comment_id): continue
+            self._delete(comment_id)
+            removed += 1
+        return removed
+
+    def _placeholder(self, comment: Comment) -> Comment:
+        """What readers get for a deleted comment: a copy with tombstone_fields written over its own"""
+        return {**comment, **self.tombstone_fields}
+
+    def _shown(self, comment: Comment) -> Comment:
+        return self._placeholder(comment) if comment['id'] in self._tombstones else comment
+
+    @property
+    def subtree_index(self) -> SubtreeIndex:
+        """Euler-tour index of the tree, built on first use and kept up to date while only leaves are added and
+        subtrees detached"""
+        if self._subtree_index is None: self._subtree_index = SubtreeIndex(self)
+        return self._subtree_index
+
+    @property
+    def aggregates(self) -> SubtreeAggregates:
+        """Per-comment descendant aggregates, built on first use and kept current from then on"""
+        if self._aggregates is None: self._aggregates = SubtreeAggregates(self)
+        return self._aggregates
+
+    def aggregate(self, comment_id: Any) -> Aggregate:
+        """Number of descendants, their highest score and their latest created_utc, without walking the subtree"""
+        return self.aggregates[comment_id]
+
+    def touch(self, comment_id: Any, fields: Optional[Iterable[str]] = None) -> None:
+        """Re-indexes a comment whose dict was changed in place and journals the change: as a fields op with the
+        current values of fields (those no longer in the comment as removed), or as the whole comment without them"""
+        comment = self.mapping[comment_id]
+        if fields is None or self._journal is None: return self.update([comment])
+        journal, self._journal = self._journal, None
+        try: self.update([comment])
+        finally: self._journal = journal
+        fields = list(fields)
+        self._record('fields', comment_id, ({field: comment[field] for field in fields if field in comment},
+                                            [field for field in fields if field not in comment]))
+
+    def sibling_orders(self, parent_ids: Optional[Iterable[Any]] = None) -> Optional[dict]:
+        """Ids of the children of each of parent_ids (ROOTS for the roots), or of every group of two or more
+        siblings, in their current order, to pass to order_changed after reordering them in place; None while no journal
+        is kept"""
+        if self._journal is None: return None
+        if parent_ids is not None: return {parent_id: list(self._sibling_ids(parent_id)) for parent_id in parent_ids}
+        groups = itertools.chain(((ROOTS, self._roots),), self.children.items())
+        return {parent_id: list(siblings) for parent_id, siblings in groups if len(siblings) > 1}
+
+    def order_changed(self, previous: Optional[dict] = None) -> None:
+        """To be called after reordering siblings in place; drops the pre-order based subtree index, and journals the
+        new order of each group that differs from previous (from sibling_orders), or without previous, a reset"""
+        self._subtree_index = None
+        if self._journal is None: return
+        if previous is None: return self._record('reset')
+        for parent_id, ids in previous.items():
+            current = list(self._sibling_ids(parent_id))
+            if current != ids: self._record('order', parent_id, current)
+
+    def _sibling_ids(self, parent_id: Any) -> Iterable[Any]:
+        return self._roots if parent_id is ROOTS else self.children.get(parent_id, ())
+
+    def start_journal(self) -> int:
+        """Starts numbering and keeping changes for changes_since; returns the current version"""
+        if self._journal is None: self._journal, self._journal_start = [], self.version
+        return self.version
+
+    def _record(self, op: str, comment_id: Any = None, payload: Any = None, old_parent: Any = _NEW) -> None:
+        journal = self._journal
+        journal.append((op, comment_id, payload, old_parent))
+        self.version += 1
+        if len(journal) > 2 * self.journal_limit:
+            del journal[:len(journal) - self.journal_limit]
+            self._journal_start = self.version - len(journal)
+
+    def changes_since(self, version: int) -> Optional[dict]:
+        """Patch from version to the current one, for apply_patch, built from the journal in O(changes): None if that
+        version is no longer journaled or a re-sort, prune or reset came after it, and the whole tree must be resent.
+
+        Ops, in order: update (a new or moved comment, or one changed in place, without 'children'), fields (changed
+        fields of a comment that stayed in place, merged per comment), remove (one comment, its replies becoming roots),
+        detach (a subtree), tombstone and restore. update (of a comment that existed), remove and detach ops carry the
+        comment's old_parent, and detach ops the [id, parent] pairs of the descendants removed with it, so subscribers
+        of a subtree can tell what was in it before. fields ops list the fields deleted from the comment as removed.
+        A moved comment is appended to its new siblings; order ops give the new order of the ids of a sibling group
+        reordered in place (the children of parent, or without parent, the roots). Sorts that rebuild the tree, and
+        order_changed without the previous orders, force a full reload.
+        """
+        if version > self.version: raise ValueError(version)
+        if self._journal is None or version < self._journal_start: return None
+        entries = self._journal[version - self._journal_start:]
+        if any(entry[0] == 'reset' for entry in entries): return None
+        ops, fields = [], {}
+        for op, comment_id, payload, old_parent in entries:
+            if op == 'fields':
+                changed, removed = payload
+                if comment_id not in fields: ops.append(fields.setdefault(comment_id, {'op': op, 'id': comment_id}))
+                merged = fields[comment_id]
+                merged.setdefault('fields', {}).update(changed)
+                gone = [k for k in merged.pop('removed', ()) if k not in changed]  # Unless set again since
+                for k in removed:
+                    merged['fields'].pop(k, None)
+                    if k not in gone: gone.append(k)
+                if gone: merged['removed'] = gone
+                continue
+            if op == 'order':
+                ops.append({'op': op, 'ids': payload})
+                if comment_id is not ROOTS: ops[-1]['parent'] = comment_id
+                continue
+            if op == 'detach': fields.clear()  # Later field changes start new ops after this one
+            else: fields.pop(comment_id, None)
+            ops.append({'op': op, 'comment': dict(payload)} if op == 'update' else {'op': op, 'id': comment_id})
+            if op == 'detach': ops[-1]['descendants'] = payload
+            if old_parent is not _NEW: ops[-1]['old_parent'] = old_parent
+        return {'from': version, 'to': self.version, 'ops': ops}
+
+    def apply_patch(self, patch: dict) -> int:
+        """Applies a patch from changes_since to a copy of the tree at its from version; returns its to version"""
+        for op in patch['ops']:
+            kind = op['op']
+            if kind == 'update': self.update([dict(op['comment'])])
+            elif kind == 'fields':
+                removed = op.get('removed', ())
+                comment = {k: v for k, v in self.mapping[op['id']].items() if k != 'children' and k not in removed}
+                comment.update(op['fields'])
+                self.update([comment])
+            elif kind == 'order':
+                parent_id = op.get('parent', ROOTS)
+                previous = self.sibling_orders([parent_id])
+                if self._owned is not None: self._own(parent_id)
+                siblings = self._writable('_roots') if parent_id is ROOTS else self.children.get(parent_id, {})
+                for comment_id in op['ids']:
+                    if comment_id in siblings: siblings.move_to_end(comment_id)
+                self.order_changed(previous)
+            elif kind == 'remove': self._delete(op['id'])
+            elif kind == 'detach': self._detach(op['id'])
+            elif kind == 'tombstone': self.tombstone(op['id'])
+            elif kind == 'restore': self.restore(op['id'])
+            else: raise ValueError(kind)
+        return patch['to']
+
+    def is_ancestor(self, ancestor_id: Any, comment_id: Any) -> bool:
+        return self.subtree_index.is_ancestor(ancestor_id, comment_id)
+
+    def subtree_size(self, comment_id: Any) -> int:
+        return self.subtree_index.subtree_size(comment_id)
+
+    def depth(self, comment_id: Any) -> int:
+        return self.subtree_index.depth(comment_id)
+
+    def subtree(self, comment_id: Any) -> List[Comment]:
+        """A comment and its descendants in pre-order, sliced from the subtree index"""
+        return [self.mapping[i] for i in self.subtree_index.subtree(comment_id)]
+
+    def add_view(self, name: str, key, descending=False, indexed: bool = False):
+        """Adds a named sibling ordering that iterate, group_by_level and __json__ accept as view. Indexed views are
+        SiblingIndexes, kept sorted on every change instead of re-sorted lazily."""
+        view = self.views[name] = (SiblingIndex if indexed else SiblingView)(self, key, descending)
+        return view
+
+    def remove_view(self, name: str) -> None:
+        del self.views[name]
+
+    def _notify_views(self, event: str, comment: Comment, roots_only: bool = False) -> None:
+        """Calls view.added or view.removed for the comment's parent and, if it is (or was, for 'removed') a root,
+        for ROOTS"""
+        is_root = comment['id'] in self._roots
+        for view in self.views.values():
+            notify = getattr(view, event)
+            if not roots_only: notify(comment['parent'], comment)
+            if roots_only or is_root: notify(ROOTS, comment)
+
+    def _children_getter(self, view: Optional[str]) -> Callable[[Comment], Iterable[Comment]]:
+        if view is None: return lambda comment, children=self.children: children.get(comment['id'], {}).values()
+        return lambda comment, children=self.views[view].children: children(comment['id'])
+
+    def _roots_of(self, view: Optional[str]) -> Iterable[Comment]:
+        return self.output.values() if view is None else self.views[view].children(ROOTS)
+
+    def _siblings(self, parent_id: Any, view: Optional[str] = None) -> Iterable[Comment]:
+        """Children of parent_id (or the roots, for ROOTS) in the order of view"""
+        if view is not None: return self.views[view].children(parent_id)
+        return (self._roots if parent_id is ROOTS else self.children.get(parent_id, {})).values()
+
+    def _sibling_slice(self, parent_id: Any, start: int, stop: int, view: Optional[str]) -> List[Comment]:
+        if view is not None: return list(self.views[view].slice(parent_id, start, stop))
+        siblings = self._roots if parent_id is ROOTS else self.children.get(parent_id, {})
+        return list(itertools.islice(siblings.values(), start, stop))
+
+    def _load_children(self, parent_ids: List[Any], stop: Optional[int] = None, view: Optional[str] = None) -> None:
+        """Called once per level by page before reading the first stop children (all of them, for None) of parent_ids
+        in the order of view; for trees that fetch lazily"""
+
+    def _load_comments(self, comment_ids: Iterable[Any]) -> None:
+        """Called by context before reading comment_ids and their ancestors; for trees that fetch lazily"""
+
+    def _with_children(self, parent_ids: List[Any], view: Optional[str] = None) -> set:
+        """The parent_ids that have children, checked by page past max_depth without reading the children"""
+        return {parent_id for parent_id in parent_ids if self._sibling_slice(parent_id, 0, 1, view)}
+
+    def page(self,
+             cursor: Cursor = Cursor(ROOTS),
+             count: int = 20,
+             max_children: int = 10,
+             max_depth: int = 8,
+             view: Optional[str] = None) -> Page:
+        """Window of the tree: count siblings from the cursor on, each with at most max_children children per level,
+        max_depth levels deep in total. Only the comments in the window (and one extra per sibling list, to know if
+        there are more) are visited, level by level; the rest of the tree is never walked. Deleted comments are returned
+        as their placeholder."""
+        self._load_children([cursor.parent_id], cursor.offset + count + 1, view)
+        top = self._sibling_slice(cursor.parent_id, cursor.offset, cursor.offset + count + 1, view)
+        more = [Cursor(cursor.parent_id, cursor.offset + count, cursor.depth)] if len(top) > count else []
+        top = top[:count]
+
+        children, level = {}, top
+        for depth in range(cursor.depth + 1, cursor.depth + max_depth):
+            if not level: break
+            self._load_children([comment['id'] for comment in level], max_children + 1, view)
+            next_level = []
+            for comment in level:
+                kids = self._sibling_slice(comment['id'], 0, max_children + 1, view)
+                if len(kids) > max_children:
+                    kids = kids[:max_children]
+                    more.append(Cursor(comment['id'], max_children, depth))
+                children[comment['id']] = kids
+                next_level.extend(kids)
+            level = next_level
+        else:
+            with_children = self._with_children([comment['id'] for comment in level], view)
+            more.extend(Cursor(comment['id'], 0, cursor.depth + max_depth) for comment in level
+                        if comment['id'] in with_children)
+
+        comments, stack = [], [(cursor.depth, comment) for comment in reversed(top)]
+        while stack:
+            depth, comment = stack.pop()
+            stack.extend((depth + 1, child) for child in reversed(children.get(comment['id'], ())))
+            comments.append((depth, self._shown(comment)))
+        return Page(comments, more)
+
+    def context(self,
+                comment_id: Any,
+                context: int = 3,
+                max_children: int = 10,
+                max_depth: int = 8,
+                view: Optional[str] = None) -> Page:
+        """Permalink view: the comment under up to context of its ancestors (one per level, from the top one down), then
+        its replies as page lays them out, max_children per level and max_depth levels deep. Depths count from the top
+        ancestor shown. Only the ancestors and the comments returned are visited: O(context + size of the result)."""
+        self._load_comments([comment_id])
+        comment, chain = self.mapping[comment_id], []
+        while len(chain) < context and comment['parent'] in self.mapping and comment['parent'] != comment_id:
+            comment = self.mapping[comment['parent']]
+            chain.append(comment)
+        chain.reverse()
+        chain.append(self.mapping[comment_id])
+        chain = [self._shown(comment) for comment in chain]
+        replies = self.page(Cursor(comment_id, 0, len(chain)), max_children, max_children, max_depth, view)
+        return Page(list(enumerate(chain)) + replies.comments, replies.more)
+
+    def copy(self) -> 'CommentTree':
+        """Snapshot of the tree that shares everything with it, copied piecewise by whichever of the two changes first:
+
+        - the comment mapping and the children dict are chunked (see _ChunkedDict), so copy costs O(n / 1024) and the
+          first change to a chunk copies its 1024 entries, plus about n / 256 index entries;
+        - each sibling group is copied the first time it changes;
+        - the roots, the tombstones and the compaction queue are copied whole the first time they change.
+
+        The first copy of a tree turns its mapping and children dict into chunked ones, which is O(n) once (half a
+        second for 300k comments), so copy a tree once after loading it, before serving it. After that, updates cost
+        about 3 times and traversals 1.3 times what they do on dicts. On a 300k-comment tree, copy and the next update
+        take 0.08 ms together, against 35 ms when the first change copied the whole mapping (see
+        benchmark.bench_copy_on_write).
+
+        Reading one tree (iterate, page, iter_json, ...) while the other is updated sees a consistent version, as long
+        as comment dicts are replaced through update rather than edited in place. copy itself writes to this tree (it
+        marks its containers shared), so it must be called on the writer's thread or under the lock the writer holds
+        while changing the tree, never concurrently with a change; only reading the copy afterwards needs no lock. A
+        writer hands snapshots to readers by calling copy after each batch of changes and publishing the result.
+
+        Structure is read through the tree, not through comment['children'], which follows the tree that last changed
+        that sibling group. Views are not copied.
+        """
+        if not isinstance(self.mapping, _ChunkedDict):
+            self.mapping, self.children = _ChunkedDict(self.mapping), _ChunkedDict(self.children, OrderedDict)
+        tree = self.__class__.__new__(self.__class__)
+        tree.mapping, tree.children, tree._roots = self.mapping.copy(), self.children.copy(), self._roots
+        tree._subtree_index = tree._aggregates = None
+        tree.version, tree._journal = self.version, None
+        tree.tombstone_mode = self.tombstone_mode
+        tree._tombstones, tree._compaction = self._tombstones, self._compaction
+        tree.views = OrderedDict()
+        tree._shared, self._shared = {'_roots', '_tombstones', '_compaction'}, {'_roots', '_tombstones', '_compaction'}
+        tree._owned, self._owned = set(), set()
+        return tree
+
+    def _writable(self, name: str):
+        """Copy-on-write of the roots, tombstones and compaction queue: the container, copied first if it is still
+        shared with a copy"""
+        if name in self._shared:
+            setattr(self, name, getattr(self, name).copy())
+            self._shared.discard(name)
+        return getattr(self, name)
+
+    def _own(self, *parent_ids: Any) -> None:
+        """Copy-on-write of sibling groups: takes private copies of those still shared with a copy, before changing
+        them"""
+        if self._owned is None: return
+        for parent_id in parent_ids:
+            if parent_id in self._owned: continue
+            self._owned.add(parent_id)
+            siblings = self.children.get(parent_id)
+            if siblings is None: continue
+            siblings = self.children[parent_id] = siblings.copy()
+            if parent_id in self.mapping: self.mapping[parent_id]['children'] = siblings
+
+    def unshare(self) -> None:
+        """Takes private copies of everything still shared with a copy, e.g. before reordering siblings in place"""
+        for name in list(self._shared): self._writable(name)
+        if self._owned is not None: self._own(*self.children)
+
+    def save(self, path: str, fields: Iterable[str] = ('score', 'created_utc'), view: Optional[str] = None) -> int:
+        """Writes a memory-mappable snapshot of the tree, to be served read-only by comment_snapshot.CommentSnapshot"""
+        from comment_snapshot import save
+        return save(self, path, fields, view)
 
     def clear(self) -> None: self.__init__()
 
-    def group_by_level(self, start_comment_id) -> Iterator[Tuple[Comment]]:
+    def group_by_level(self, start_comment_id, view: Optional[str] = None) -> Iterator[Tuple[Comment]]:
         """Iterator returning list of comments grouped by depth/level"""
-        queue = (self.mapping[start_comment_id],) if start_comment_id is not None else tuple(self.output.values())
+        children = self._children_getter(view)
+        queue = (self.mapping[start_comment_id],) if start_comment_id is not None else tuple(self._roots_of(view))
         while queue:
-            yield queue
-            queue = tuple(child for parent in queue for child in parent['children'].values())
+            yield tuple(map(self._shown, queue)) if self._tombstones else queue
+            queue = tuple(child for parent in queue for child in children(parent))
 
-    def iterate(self, start_comment_id=None) -> Iterator[Comment]:
-        """Pre-order iteration"""
-        queue = deque((self.mapping[start_comment_id],) if start_comment_id is not None else self.output.values())
+    def iterate(self, start_comment_id=None, view: Optional[str] = None) -> Iterator[Comment]:
+        """Pre-order iteration; deleted comments come as their placeholder"""
+        for comment in self._iterate(start_comment_id, view):
+            yield self._shown(comment)
+
+    def _iterate(self, start_comment_id=None, view: Optional[str] = None) -> Iterator[Comment]:
+        """Pre-order iteration over the comments as stored"""
+        children = self._children_getter(view)
+        queue = deque((self.mapping[start_comment_id],) if start_comment_id is not None else self._roots_of(view))
         while queue:
             comment = queue.popleft()
             yield comment
-            queue.extendleft(reversed(comment['children'].values()))
+            queue.extendleft(reversed(children(comment)))
 
     def __len__(self) -> int:
         return len(self.mapping)
@@ -88,13 +1023,34 @@ class CommentTree:
         return self.mapping[comment_id]
 
     def __delitem__(self, comment_id: Any) -> None:
+        if self.tombstone_mode: self.tombstone(comment_id)
+        else: self._delete(comment_id)
+
+    def _delete(self, comment_id: Any) -> None:
         comment = self.mapping[comment_id]
+        if self._owned is not None: self._own(comment['parent'])
+        if self.views: self._notify_views('removed', comment)
+        aggregates = self._aggregates
+        if aggregates is not None:
+            if comment_id in aggregates.nodes: contribution = aggregates.contribution(comment_id)
+            else: aggregates = self._aggregates = None  # Its children become reachable roots
+        if self._subtree_index is not None:
+            if self.children.get(comment_id): self._subtree_index = None
+            elif comment_id in self._subtree_index.nodes: self._subtree_index.remove_subtree(comment_id)
         del self.children[comment['parent']][comment_id]
         if comment['parent'] not in self.mapping and not self.children[comment['parent']]:
             del self.children[comment['parent']]
         if not self.children[comment_id]: del self.children[comment_id]
         del self.mapping[comment_id]
-        self._output = None
+        if comment_id in self._roots: self._writable('_roots').pop(comment_id)
+        for child_id, child in self.children.get(comment_id, {}).items():
+            self._writable('_roots')[child_id] = child
+            if self.views: self._notify_views('added', child, roots_only=True)
+        if aggregates is not None:
+            aggregates.subtract(comment['parent'], contribution)
+            aggregates.pop(comment_id)
+        self._removed(comment_id, comment['parent'])
+        if self._journal is not None: self._record('remove', comment_id, None, comment['parent'])
 
     def __bool__(self) -> bool:
         return bool(self.mapping)
@@ -103,58 +1059,399 @@ class CommentTree:
         yield from self.iterate()
 
     def __repr__(self) -> str:  # DEBUG: Fix
-        return f'''{self.__class__.__name__}({list(self.mapping.values())!r})'''
+        return f'''{self.__class__.__name__}({list(map(self._shown, self.mapping.values()))!r})'''
+
+    def iter_json(self,
+                  start_comment_id=None,
+                  view: Optional[str] = None,
+                  fields: Optional[Iterable[str]] = None) -> Iterator[str]:
+        """Compact JSON of output (or of the subtree of start_comment_id) in chunks, one per comment, built with an
+        explicit stack so that reply chains of any depth are serialized. With fields, only those keys of each comment
+        are written, besides 'children'. Deleted comments have their tombstone_fields written over theirs."""
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        fields = None if fields is None else tuple(field for field in fields if field != 'children')
+
+        def head(comment: Comment) -> str:
+            if fields is None: items = comment.items()
+            else: items = ((k, comment[k]) for k in fields if k in comment)
+            if comment['id'] in tombstones: items = {**dict(items), **self.tombstone_fields}.items()
+            body = ''.join(f'{_encode_json_key(encode, k)}:{encode(v)},' for k, v in items if k != 'children')
+            return f'{_encode_json_key(encode, comment["id"])}:{{{body}"children":{{'
+
+        children, tombstones = self._children_getter(view), self._tombstones
+        top = (self.mapping[start_comment_id],) if start_comment_id is not None else self._roots_of(view)
+        stack, first = [iter(top)], True
+        yield '{'
+        while stack:
+            comment = next(stack[-1], None)
+            if comment is None:
+                stack.pop()
+                yield '}}' if stack else '}'
+                first = False
+                continue
+            yield head(comment) if first else ',' + head(comment)
+            stack.append(iter(children(comment)))
+            first = True
+
+    def dump(self, fp, start_comment_id=None, view: Optional[str] = None, fields: Optional[Iterable[str]] = None,
+             buffer_size: int = 1 << 16) -> None:
+        """Writes iter_json to a text or binary file, or a socket, buffer_size characters at a time, so the first
+        bytes go out before the rest of the tree is serialized"""
+        _write_chunks(fp, self.iter_json(start_comment_id, view, fields), buffer_size)
+
+    def __json__(self, view: Optional[str] = None):
+        result, containers = OrderedDict(), {}
+        for comment in self.iterate(view=view):
+            node = containers[comment['id']] = OrderedDict()
+            parent = result if comment['id'] in self._roots else containers[comment['parent']]
+            parent[comment['id']] = {**comment, 'children': node}
+        return json.dumps(result, indent=4)
+
+def _encode_json_key(encode: Callable, key: Any) -> str:
+    """JSON object keys must be strings, so other ids are written as their JSON encoding, quoted"""
+    return encode(key if isinstance(key, str) else encode(key))
+
+def _write_chunks(fp, chunks: Iterable[str], buffer_size: int) -> None:
+    write = fp.write if hasattr(fp, 'write') else fp.sendall
+    binary = not isinstance(fp, io.TextIOBase)
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            write(''.join(buffer).encode() if binary else ''.join(buffer))
+            buffer, size = [], 0
+    if buffer: write(''.join(buffer).encode() if binary else ''.join(buffer))
+
+class ColumnarCommentTree:
+    """Compact comment tree for very large threads.
+
+    Structure is kept in typed arrays indexed by slot (insertion position): parent slot, first/last child and
+    next/previous sibling, plus one float array per numeric field. Comment payloads are kept as-is in a separate list
+    and never get a 'children' key. Slots of removed comments are left empty until prune compacts the arrays.
+    """
+    def __init__(self, comments: Iterable[Comment] = None, numeric_fields: Iterable[str] = ('score', 'created_utc')):
+        self.ids = []
+        self.index = {}
+        self.payloads = []
+        self.parents = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.prev_sibling = array('i')
+        self.fields = OrderedDict((name, array('d')) for name in numeric_fields)
+        self._first_root = self._last_root = -1
+        self._waiting = defaultdict(list)
+        if comments is not None: self.update(comments)
+
+    def update(self, comments: Iterable[Comment]) -> None:
+        for comment in comments:
+            slot, parent_slot = self.index.get(comment['id']), self.index.get(comment['parent'], -1)
+            if parent_slot == -1 and comment['parent'] is not None: waiting = self._waiting[comment['parent']]
+            else: waiting = None
+            if slot is None:
+                slot = self._append(comment)
+            else:
+                previous, self.payloads[slot] = self.payloads[slot], comment  # Read the old parent before replacing it
+                for name, values in self.fields.items(): values[slot] = comment.get(name) or 0.0
+                if comment['parent'] == previous['parent']: continue
+                if waiting is not None: waiting.append(slot)
+                if parent_slot == -1 and self.parents[slot] == -1: continue  # Still a root, in the same place
+                self._unlink(slot)
+                self._link(slot, parent_slot)
+                continue
+            if waiting is not None: waiting.append(slot)
+            self._link(slot, parent_slot)
+            self._adopt(slot)
+
+    def _append(self, comment: Comment) -> int:
+        slot = len(self.ids)
+        self.ids.append(comment['id'])
+        self.index[comment['id']] = slot
+        self.payloads.append(comment)
+        for values in (self.parents, self.first_child, self.last_child, self.next_sibling, self.prev_sibling):
+            values.append(-1)
+        for name, values in self.fields.items(): values.append(comment.get(name) or 0.0)
+        return slot
+
+    def _parent_id(self, slot: int) -> Any:
+        return self.payloads[slot]['parent']
+
+    def _adopt(self, slot: int) -> None:
+        """Moves comments that arrived before this one, and were roots until now, under it."""
+        for child_slot in self._waiting.pop(self.ids[slot], ()):
+            if self.ids[child_slot] is None or self._parent_id(child_slot) != self.ids[slot]: continue
+            self._unlink(child_slot)
+            self._link(child_slot, slot)
+
+    def _link(self, slot: int, parent_slot: int) -> None:
+        self.parents[slot] = parent_slot
+        last = self.last_child[parent_slot] if parent_slot != -1 else self._last_root
+        self.prev_sibling[slot], self.next_sibling[slot] = last, -1
+        if last != -1: self.next_sibling[last] = slot
+        elif parent_slot != -1: self.first_child[parent_slot] = slot
+        else: self._first_root = slot
+        if parent_slot != -1: self.last_child[parent_slot] = slot
+        else: self._last_root = slot
+
+    def _unlink(self, slot: int) -> None:
+        parent_slot, prev, next_ = self.parents[slot], self.prev_sibling[slot], self.next_sibling[slot]
+        if prev != -1: self.next_sibling[prev] = next_
+        elif parent_slot != -1: self.first_child[parent_slot] = next_
+        else: self._first_root = next_
+        if next_ != -1: self.prev_sibling[next_] = prev
+        elif parent_slot != -1: self.last_child[parent_slot] = prev
+        else: self._last_root = prev
+        self.parents[slot] = self.prev_sibling[slot] = self.next_sibling[slot] = -1
+
+    def _free(self, slot: int) -> None:
+        del self.index[self.ids[slot]]
+        self.ids[slot] = self.payloads[slot] = None
+        self.first_child[slot] = self.last_child[slot] = -1
+
+    def _children(self, slot: int) -> Iterator[int]:
+        child = self.first_child[slot] if slot != -1 else self._first_root
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def _preorder(self, start_slot: int = -1) -> Iterator[int]:
+        """Pre-order slots under start_slot (inclusive), or of the whole tree if it's -1"""
+        if start_slot == -1:
+            stack = [self._first_root] if self._first_root != -1 else []
+        else:
+            stack = [start_slot]
+        first_child, next_sibling = self.first_child, self.next_sibling
+        while stack:
+            slot = stack.pop()
+            yield slot
+            if slot != start_slot and next_sibling[slot] != -1: stack.append(next_sibling[slot])
+            if first_child[slot] != -1: stack.append(first_child[slot])
+
+    @property
+    def output(self) -> OrderedDict:
+        """Returns comment tree as a nested list of dicts, built from the payloads on every call; serialize with
+        iter_json or dump instead, which don't build it"""
+        result = OrderedDict()
+        containers = {-1: result}
+        for slot in self._preorder():
+            node = containers[slot] = OrderedDict()
+            containers[self.parents[slot]][self.ids[slot]] = {**self.payloads[slot], 'children': node}
+        return result
+
+    def iter_json(self, start_comment_id=None, fields: Optional[Iterable[str]] = None) -> Iterator[str]:
+        """Compact JSON of output (or of the subtree of start_comment_id) in chunks, one per comment, streamed from the
+        arrays. With fields, only those keys of each comment are written, besides 'children'."""
+        encode = json.JSONEncoder(separators=(',', ':')).encode
+        fields = None if fields is None else tuple(field for field in fields if field != 'children')
+        ids, payloads = self.ids, self.payloads
+        top = iter((self.index[start_comment_id],)) if start_comment_id is not None else self._children(-1)
+
+        def head(slot: int) -> str:
+            payload = payloads[slot]
+            items = payload.items() if fields is None else ((k, payload[k]) for k in fields if k in payload)
+            body = ''.join(f'{_encode_json_key(encode, k)}:{encode(v)},' for k, v in items if k != 'children')
+            return f'{_encode_json_key(encode, ids[slot])}:{{{body}"children":{{'
+
+        stack, first = [top], True
+        yield '{'
+        while stack:
+            slot = next(stack[-1], None)
+            if slot is None:
+                stack.pop()
+                yield '}}' if stack else '}'
+                first = False
+                continue
+            yield head(slot) if first else ',' + head(slot)
+            stack.append(self._children(slot))
+            first = True
+
+    def dump(self, fp, start_comment_id=None, fields: Optional[Iterable[str]] = None,
+             buffer_size: int = 1 << 16) -> None:
+        """Writes iter_json to a text or binary file, or a socket, buffer_size characters at a time"""
+        _write_chunks(fp, self.iter_json(start_comment_id, fields), buffer_size)
+
+    def detach(self, comment_id: Any) -> None:
+        """Detach a comment and all its descendants from the tree"""
+        if comment_id is None: return self.clear()
+        slot = self.index[comment_id]
+        subtree = list(self._preorder(slot))
+        self._unlink(slot)
+        for s in subtree: self._free(s)
+
+    def prune(self, max_length: int) -> None:
+        """Prune the comment tree up to max_length, choosing only the top-most comments and their ancestors."""
+        if max_length <= 0: return self.clear()
+        elif max_length >= len(self.index): return
+
+        keep, kept = bytearray(len(self.ids)), 0
+        for slot in range(len(self.ids)):
+            if self.ids[slot] is None: continue
+            chain = []
+            while slot != -1 and not keep[slot]:
+                chain.append(slot)
+                keep[slot] = 1
+                slot = self.parents[slot]
+            if kept + len(chain) > max_length:
+                for s in chain: keep[s] = 0
+                break
+            kept += len(chain)
+        for slot in range(len(self.ids)):
+            if self.ids[slot] is not None and not keep[slot] and (self.parents[slot] == -1 or keep[self.parents[slot]]):
+                self._unlink(slot)
+        self._compact(keep)
+
+    def _compact(self, keep: bytearray) -> None:
+        """Drops the slots not in keep, none of which may still be linked to a kept one, keeping the order of the
+        others and their links"""
+        slots = [slot for slot, flag in enumerate(keep) if flag]
+        remap = {-1: -1, **{slot: new_slot for new_slot, slot in enumerate(slots)}}
+        self.ids = [self.ids[slot] for slot in slots]
+        self.payloads = [self.payloads[slot] for slot in slots]
+        self.index = {comment_id: slot for slot, comment_id in enumerate(self.ids)}
+        for name in ('parents', 'first_child', 'last_child', 'next_sibling', 'prev_sibling'):
+            values = getattr(self, name)
+            setattr(self, name, array('i', (remap[values[slot]] for slot in slots)))
+        for name, values in self.fields.items(): self.fields[name] = array('d', (values[slot] for slot in slots))
+        self._first_root, self._last_root = remap[self._first_root], remap[self._last_root]
+        waiting = ((parent_id, [remap[slot] for slot in children if slot in remap and slot != -1])
+                   for parent_id, children in self._waiting.items())
+        self._waiting = defaultdict(list, ((parent_id, children) for parent_id, children in waiting if children))
+
+    def copy(self) -> 'ColumnarCommentTree':
+        tree = self.__class__(numeric_fields=tuple(self.fields))
+        tree.ids, tree.index, tree.payloads = self.ids.copy(), self.index.copy(), self.payloads.copy()
+        for name in ('parents', 'first_child', 'last_child', 'next_sibling', 'prev_sibling'):
+            setattr(tree, name, array('i', getattr(self, name)))
+        tree.fields = OrderedDict((name, array('d', values)) for name, values in self.fields.items())
+        tree._first_root, tree._last_root = self._first_root, self._last_root
+        tree._waiting = defaultdict(list, ((k, v.copy()) for k, v in self._waiting.items()))
+        return tree
+
+    def clear(self) -> None: self.__init__(numeric_fields=tuple(self.fields))
+
+    def group_by_level(self, start_comment_id=None) -> Iterator[Tuple[Comment]]:
+        """Iterator returning list of comments grouped by depth/level"""
+        level = [self.index[start_comment_id]] if start_comment_id is not None else list(self._children(-1))
+        while level:
+            yield tuple(self.payloads[slot] for slot in level)
+            level = [child for slot in level for child in self._children(slot)]
+
+    def iterate(self, start_comment_id=None) -> Iterator[Comment]:
+        """Pre-order iteration"""
+        start_slot = self.index[start_comment_id] if start_comment_id is not None else -1
+        for slot in self._preorder(start_slot): yield self.payloads[slot]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, comment_id: Any) -> bool:
+        return comment_id in self.index
+
+    def __getitem__(self, comment_id: Any) -> Comment:
+        return self.payloads[self.index[comment_id]]
+
+    def __delitem__(self, comment_id: Any) -> None:
+        slot = self.index[comment_id]
+        children = list(self._children(slot))
+        self._unlink(slot)
+        for child in children:
+            self._unlink(child)
+            self._link(child, -1)
+        if children: self._waiting[comment_id].extend(children)
+        self._free(slot)
+
+    def __bool__(self) -> bool:
+        return bool(self.index)
+
+    def __iter__(self) -> Iterator[Comment]:
+        yield from self.iterate()
+
+    def __repr__(self) -> str:
+        return f'''{self.__class__.__name__}({[p for p in self.payloads if p is not None]!r})'''
 
     def __json__(self):
-        return json.dumps(self.output, indent=4)
+        return ''.join(self.iter_json())
 
 class CommentTreeSorter:
+    """Sorts a CommentTree by rebuilding it from all comments sorted globally, or with in_place=True by reordering each
+    sibling group where it is, without rebuilding the tree. key and descending may be tuples for a stable multi-key
+    sort, each key with its own direction."""
     @staticmethod
-    def custom_sort(comment_tree: CommentTree, key: Callable, descending: bool = False):
-        comment_tree.__init__(sorted(comment_tree.mapping.values(),
-                                     key=key,
-                                     reverse=descending))
-        return comment_tree
+    def custom_sort(comment_tree: CommentTree, key: Callable, descending: bool = False, in_place: bool = False):
+        return CommentTreeSorter._sort(comment_tree, key, descending, in_place)
 
     @staticmethod
-    def sort_by_id(comment_tree: CommentTree, descending: bool = False) -> CommentTree:
-        comment_tree.__init__(sorted(comment_tree.mapping.values(),
-                                     key=lambda c: c['id'],
-                                     reverse=descending))
-        return comment_tree
+    def sort_by_id(comment_tree: CommentTree, descending: bool = False, in_place: bool = False) -> CommentTree:
+        return CommentTreeSorter._sort(comment_tree, lambda c: c['id'], descending, in_place)
 
     @staticmethod
-    def sort_by_random(comment_tree: CommentTree) -> CommentTree:
+    def sort_by_random(comment_tree: CommentTree, in_place: bool = False) -> CommentTree:
+        if in_place:
+            previous = comment_tree.sibling_orders()
+            for siblings in CommentTreeSorter._sibling_groups(comment_tree):
+                order = list(siblings)
+                random.shuffle(order)
+                for comment_id in order: siblings.move_to_end(comment_id)
+            comment_tree.order_changed(previous)
+            return comment_tree
         items = list(comment_tree.mapping.values())
         random.shuffle(items)
         comment_tree.__init__(items)
         return comment_tree
 
     @staticmethod
-    def sort_by_score(comment_tree: CommentTree, descending: bool = True) -> CommentTree:
-        comment_tree.__init__(sorted(comment_tree.mapping.values(),
-                                     key=lambda c: c['score'],
-                                     reverse=descending))
-        return comment_tree
+    def sort_by_score(comment_tree: CommentTree, descending: bool = True, in_place: bool = False) -> CommentTree:
+        return CommentTreeSorter._sort(comment_tree, lambda c: c['score'], descending, in_place)
 
     @staticmethod
     def sort_by_votes(comment_tree: CommentTree, voter_type=None, descending: bool = True) -> CommentTree:
-        pass
+        """Sorts siblings in place by a vote ranking of ranking.RankingEngine: 'best' (default), 'hot' or
+        'controversy'"""
+        from ranking import RankingEngine
+        return RankingEngine().sort(comment_tree, voter_type or 'best', descending)
 
     @staticmethod
-    def sort_by_created(comment_tree: CommentTree, descending: bool = True) -> CommentTree:
-        comment_tree.__init__(sorted(comment_tree.mapping.values(),
-                                     key=lambda c: c['created_utc'],
-                                     reverse=descending))
+    def sort_by_created(comment_tree: CommentTree, descending: bool = True, in_place: bool = False) -> CommentTree:
+        return CommentTreeSorter._sort(comment_tree, lambda c: c['created_utc'], descending, in_place)
+
+    @staticmethod
+    def sort_by_contentiousness(comment_tree: CommentTree,
+                                descending: bool = True,
+                                in_place: bool = False) -> CommentTree:
+        return CommentTreeSorter._sort(comment_tree, lambda c: c['contentiousness'], descending, in_place)
+
+    @staticmethod
+    def sort_siblings(comment_tree: CommentTree, key, descending=False) -> CommentTree:
+        """Stable in-place sort of the roots and of every comment's children; comment records are left untouched."""
+        previous = comment_tree.sibling_orders()
+        for siblings in CommentTreeSorter._sibling_groups(comment_tree):
+            if len(siblings) < 2: continue
+            for comment in CommentTreeSorter._sorted(siblings.values(), key, descending):
+                siblings.move_to_end(comment['id'])
+        comment_tree.order_changed(previous)
         return comment_tree
 
     @staticmethod
-    def sort_by_contentiousness(comment_tree: CommentTree, descending: bool = True) -> CommentTree:
-        comment_tree.__init__(sorted(comment_tree.mapping.values(),
-                                     key=lambda c: c['contentiousness'],
-                                     reverse=descending))
+    def _sort(comment_tree: CommentTree, key, descending, in_place: bool) -> CommentTree:
+        if in_place: return CommentTreeSorter.sort_siblings(comment_tree, key, descending)
+        comment_tree.__init__(CommentTreeSorter._sorted(comment_tree.mapping.values(), key, descending))
         return comment_tree
 
+    @staticmethod
+    def _sorted(comments: Iterable[Comment], key, descending) -> List[Comment]:
+        keys = key if isinstance(key, tuple) else (key,)
+        directions = descending if isinstance(descending, tuple) else (descending,) * len(keys)
+        result = list(comments)
+        for k, d in reversed(tuple(zip(keys, directions))): result.sort(key=k, reverse=d)
+        return result
+
+    @staticmethod
+    def _sibling_groups(comment_tree: CommentTree) -> Iterator[OrderedDict]:
+        comment_tree.unshare()
+        yield comment_tree.output
+        yield from comment_tree.children.values()
+
 def _generate_data(num_comments=10000, num_parents=5000, seed=0, start_index=0, sort_by_score=True):  # DEBUG
     from random import Random
     from utils.bases import Base36
@@ -1,33 +1,167 @@
+import gc
 import html
+import os
 import re
 import string
-from typing import Callable, Iterable, Mapping, Match, Optional, Pattern
+import struct
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
+from multiprocessing.context import BaseContext
+from types import MappingProxyType
+from typing import Callable, Iterable, List, Mapping, Match, Optional, Pattern, Tuple
 from utils.emojis import EMOJIs
 
 class MissingPattern(Exception): pass
 
 class InvalidMatch(Exception): pass
 
+class RenderedDocument:
+    """Rendered output plus the (start, end) offsets of every markup token in it, so that other targets can be
+    emitted without parsing the source again."""
+    _header = struct.Struct('<4sII')
+    _magic = b'RDC1'
+    _text_separators = {'td': ' ', 'th': ' ', 'tr': '\n', 'li': '\n', 'hr': '\n', 'table': '\n', 'ul': '\n',
+                        'ol': '\n', 'h1': '\n', 'h2': '\n', 'h3': '\n', 'h4': '\n', 'h5': '\n', 'h6': '\n'}
+    _text_opening_separators = {'tr': '\n', 'li': '\n', 'table': '\n', 'ul': '\n', 'ol': '\n', 'h1': '\n', 'h2': '\n',
+                                'h3': '\n', 'h4': '\n', 'h5': '\n', 'h6': '\n'}
+    _tag_name_re = re.compile(r'</?([a-zA-Z0-9]+)')
+    _entity_re = re.compile(r'&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);')
+    _blank_lines_re = re.compile(r'[ \t]*\n\s*')
+
+    def __init__(self, text: str, markup: array) -> None:
+        self.text = text
+        self.markup = markup
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'RenderedDocument':
+        magic, markup_length, text_length = cls._header.unpack_from(data)
+        if magic != cls._magic: raise ValueError(magic)
+        markup = array('I', struct.unpack_from(f'<{markup_length}I', data, cls._header.size))
+        offset = cls._header.size + markup_length * 4  # Little-endian uint32s, whatever the platform's array('I')
+        text = data[offset:offset + text_length].decode('utf-8')
+        return cls(text, markup)
+
+    def to_bytes(self) -> bytes:
+        text = self.text.encode('utf-8')
+        markup = struct.pack(f'<{len(self.markup)}I', *self.markup)
+        return self._header.pack(self._magic, len(self.markup), len(text)) + markup + text
+
+    def to_html(self) -> str:
+        return self.text
+
+    def to_text(self) -> str:
+        """Plain text, with rows, list items and other blocks on their own lines, nested ones included:
+
+        >>> d.compile('* first\\n** nested\\n* second').to_text()
+        'first\\nnested\\nsecond'
+        >>> d.compile('# one\\n## one.a\\n=|a|b|\\n|c|d|').to_text()
+        'one\\none.a\\na b\\nc d'
+        """
+        output, current_pos, text, markup = [], 0, self.text, self.markup
+        for i in range(0, len(markup), 2):
+            output.append(html.unescape(text[current_pos:markup[i]]))
+            closing = text[markup[i] + 1] == '/' or text[markup[i + 1] - 2] == '/'
+            separators = self._text_separators if closing else self._text_opening_separators
+            output.append(separators.get(self._tag_name(markup[i], markup[i + 1]), ''))
+            current_pos = markup[i + 1]
+        output.append(html.unescape(text[current_pos:]))
+        return self._blank_lines_re.sub('\n', ''.join(output)).strip()
+
+    def to_preview(self, max_length: int, ellipsis: str = '\u2026') -> str:
+        """HTML cut after max_length characters of text, an entity counting as one, with any tags left open closed
+        again:
+
+        >>> d.compile('fish & chips **and** more').to_preview(8, '...')
+        'fish &amp; c...'
+        """
+        output, open_tags, current_pos, remaining, text, markup = [], [], 0, max_length, self.text, self.markup
+        for i in range(0, len(markup) + 2, 2):
+            start, end = (markup[i], markup[i + 1]) if i < len(markup) else (len(text), len(text))
+            length = self._text_length(current_pos, start)
+            if length > remaining:
+                output.append(text[current_pos:self._text_offset(current_pos, remaining)] + ellipsis)
+                output.extend(f'</{name}>' for name in reversed(open_tags))
+                return ''.join(output)
+            remaining -= length
+            output.append(text[current_pos:end])
+            if start != end:
+                name = self._tag_name(start, end)
+                if text[start + 1] == '/':
+                    if name in open_tags: del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name)]
+                elif text[end - 2] != '/':
+                    open_tags.append(name)
+            current_pos = end
+        return text
+
+    def _text_length(self, start: int, end: int) -> int:
+        """Characters of text between two offsets, an entity counting as one"""
+        return end - start - sum(len(match[0]) - 1 for match in self._entity_re.finditer(self.text, start, end))
+
+    def _text_offset(self, start: int, count: int) -> int:
+        """Offset count characters of text after start, an entity counting as one"""
+        for match in self._entity_re.finditer(self.text, start):
+            if match.start() - start >= count: break
+            count -= match.start() - start + 1
+            start = match.end()
+        return start + count
+
+    def _tag_name(self, start: int, end: int) -> str:
+        match = self._tag_name_re.match(self.text, start, end)
+        return match[1].lower() if match else ''
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RenderedDocument): return NotImplemented
+        return self.text == other.text and self.markup == other.markup
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self.text!r}, {self.markup!r})'
+
 class Renderer:
+    """Regex-driven markup renderer.
+
+    All configuration is frozen into tuples and read-only mappings in __init__ and parsing only keeps state in local
+    variables, so a single instance can be shared by any number of threads, including on free-threaded builds.
+    Subclasses must keep any attributes they add read-only after __init__ to preserve this.
+    """
+    _block_boundary_re = re.compile(r'^(?=$)', flags=re.MULTILINE)
+    _markup_re = re.compile(r'<[^<>]*>')
+
     def __init__(self,
                  pre_processors: Optional[Iterable[Callable]] = None,
                  patterns: Optional[Mapping[str, Pattern]] = None,
                  descent_rules: Optional[Mapping[str, Iterable[str]]] = None,
                  transforms: Optional[Mapping[str, Callable]] = None,
                  post_processors: Optional[Iterable[Callable]] = None) -> None:
-        self._pre_processors = pre_processors if pre_processors is not None else []
-        self._patterns = patterns if patterns is not None else {}
-        self._descent_rules = descent_rules if descent_rules is not None else {}
-        self._transforms = transforms if transforms is not None else {}
-        self._post_processors = post_processors if post_processors is not None else []
+        self._pre_processors = tuple(pre_processors or ())
+        self._patterns = MappingProxyType(dict(patterns or {}))
+        self._descent_rules = MappingProxyType(dict(descent_rules or {}))
+        self._transforms = MappingProxyType(dict(transforms or {}))
+        self._post_processors = tuple(post_processors or ())
 
-        self._descent_regexes = {}
+        descent_regexes = {}
 
         for name, descendees in self._descent_rules.items():
-            if descendees: self._descent_regexes[name] = re.compile(
+            if descendees: descent_regexes[name] = re.compile(
                 pattern='|'.join(self._patterns[descendee_name] for descendee_name in descendees),
                 flags=re.DOTALL | re.MULTILINE,
             )
+        self._descent_regexes = MappingProxyType(descent_regexes)
+
+    def __getstate__(self) -> Tuple[dict, List[str]]:
+        """Read-only mappings can't be pickled (as parse_parallel does to send the renderer to workers started with
+        spawn or forkserver), so they are pickled as dicts and frozen again by __setstate__"""
+        state = self.__dict__.copy()
+        frozen = [name for name, value in state.items() if isinstance(value, MappingProxyType)]
+        for name in frozen: state[name] = dict(state[name])
+        return state, frozen
+
+    def __setstate__(self, state: Tuple[dict, List[str]]) -> None:
+        state, frozen = state
+        for name in frozen: state[name] = MappingProxyType(state[name])
+        self.__dict__.update(state)
 
     def parse(self, text: str):
         for p in self._pre_processors: text = p(text)
@@ -35,6 +169,13 @@ class Renderer:
         for p in self._post_processors: text = p(text)
         return text
 
+    def compile(self, text: str) -> RenderedDocument:
+        """Parses text once into a RenderedDocument that can be stored and emitted as HTML, plain text or preview."""
+        text = self.parse(text)
+        markup = array('I')
+        for match in self._markup_re.finditer(text): markup.extend(match.span())
+        return RenderedDocument(text, markup)
+
     def _parse(self, text: str, rule: Optional[str] = None):
         output = []
         current_pos, text_length = 0, len(text)
@@ -53,7 +194,107 @@ class Renderer:
         output.append(text[current_pos:])
         return ''.join(output)
 
+    def parse_parallel(self,
+                       text: str,
+                       max_workers: Optional[int] = None,
+                       min_block_size: int = 1 << 16,
+                       mp_context: Optional[BaseContext] = None) -> str:
+        """Same output as parse, but renders top-level blocks of at least min_block_size chars in a process pool, whose
+        processes are started by mp_context (the platform default if None). The pool is started on the first call and
+        reused by every later call with the same max_workers and mp_context."""
+        for p in self._pre_processors: text = p(text)
+        bounds = self._block_bounds(text, min_block_size)
+        if len(bounds) > 2:
+            executor = _parallel_pool(max_workers, mp_context)
+            chunk_size = -(-(len(bounds) - 1) // (max_workers or os.cpu_count() or 1))  # Text is sent once per chunk
+            try:
+                results = list(executor.map(_parse_parallel_block, repeat(self), repeat(text), bounds[:-1], bounds[1:],
+                                            chunksize=chunk_size))
+            except BrokenProcessPool:
+                # Start afresh next time
+                with _parallel_pools_lock: _parallel_pools.pop((max_workers, mp_context), None)
+                raise
+            text = self._join_blocks(text, bounds, results)
+        else:
+            text = self._parse(text)
+        for p in self._post_processors: text = p(text)
+        return text
+
+    def _block_bounds(self, text: str, min_block_size: int) -> List[int]:
+        bounds, text_length = [0], len(text)
+        while bounds[-1] + min_block_size < text_length:
+            match = self._block_boundary_re.search(text, bounds[-1] + min_block_size)
+            if not match: break
+            bounds.append(match.start())
+        bounds.append(text_length)
+        return bounds
+
+    def _join_blocks(self, text: str, bounds: List[int], results: List[Tuple[str, int, int]]) -> str:
+        """Joins block results, re-rendering any block whose start was swallowed by a match from the previous one, and
+        the plain text a block ends with when a match starting in it runs past the block."""
+        output, current_pos, next_start, regex = [], 0, -1, self._descent_regexes[None]
+        for start, end, (block_output, block_end, tail) in zip(bounds, bounds[1:], results):
+            if current_pos >= end: continue
+            if current_pos != start: block_output, block_end, tail = self._parse_range(text, current_pos, end)
+            if tail < end:
+                if next_start < tail:  # Tails only move forward, so one search serves every tail up to its match
+                    match = regex.search(text, tail)
+                    next_start = match.start() if match else len(text)
+                if next_start < end:
+                    rest, block_end, _ = self._parse_range(text, tail, end, bounded=False)
+                    block_output = block_output[:len(block_output) - (end - tail)] + rest
+            output.append(block_output)
+            current_pos = block_end
+        return ''.join(output)
+
+    def _parse_range(self,
+                     text: str,
+                     start: int,
+                     end: int,
+                     rule: Optional[str] = None,
+                     bounded: bool = True) -> Tuple[str, int, int]:
+        """Top-level _parse loop restricted to matches starting in [start, end). Returns output, the end position,
+        which is past end when the last match runs over it, and the start of the plain text output ends with if a match
+        starting in it could still run past end (end otherwise).
+
+        If bounded, each search first looks for a match before end only, so that the rest of the document isn't
+        searched once the block has no markup left. That search misses matches that only close after end, which is why
+        the plain tail is returned for _join_blocks to check."""
+        output, current_pos, tail, regex = [], start, end, self._descent_regexes[rule]
+
+        while current_pos < end:
+            if bounded and not regex.search(text, current_pos, end):
+                tail = current_pos
+                break
+            match = regex.search(text, current_pos)
+            if not match or match.start() >= end: break
+            try:
+                output.append(text[current_pos:match.start()] + self._transforms[match.lastgroup](match))
+                current_pos = match.end()
+            except InvalidMatch:
+                output.append(text[current_pos])
+                current_pos += 1
+
+        if current_pos < end:
+            output.append(text[current_pos:end])
+            current_pos = end
+        return ''.join(output), current_pos, tail
+
+_parallel_pools = {}  # (max_workers, mp_context) -> ProcessPoolExecutor
+_parallel_pools_lock = threading.Lock()
+
+def _parallel_pool(max_workers: Optional[int], mp_context: Optional[BaseContext]) -> ProcessPoolExecutor:
+    with _parallel_pools_lock:
+        key = max_workers, mp_context
+        if key not in _parallel_pools: _parallel_pools[key] = ProcessPoolExecutor(max_workers, mp_context)
+        return _parallel_pools[key]
+
+def _parse_parallel_block(renderer: Renderer, text: str, start: int, end: int) -> Tuple[str, int, int]:
+    return renderer._parse_range(text, start, end)
+
 class DefaultRenderer(Renderer):
+    _block_boundary_re = re.compile(r'^(?=$|=|\||\* |# |-{4,}$)', flags=re.MULTILINE)
+
     def __init__(self):
         super().__init__(
             pre_processors=[
@@ -135,10 +376,16 @@ class DefaultRenderer(Renderer):
         self._non_printable_table = {c: None for c in range(160) if chr(c) not in string.printable}
         self._newline_re = re.compile(r'\r\n?')
         self._table_row_split = re.compile(r'(?<=(?<!\\)\|)\n')
+        self._table_cell_trigger_re = re.compile(r'--|//|__|\*\*|\^\^|~~|\[\[|@|:[-+a-zA-Z0-9_]+:|^(?:[*#] |=+ )')
         self._bullet_list_split_re = re.compile(r'(\*+) (.*?)($|(?<!\\)\n)')
         self._number_list_split_re = re.compile(r'(#+) (.*?)($|(?<!\\)\n)')
         self._backslash_escape_re = re.compile(r'\\([-\\{}\[\]:@#*/_^~|])')
 
+    def __reduce__(self):
+        # Everything is built by __init__, so workers rebuild the renderer instead of unpickling its tables. Subclasses
+        # whose __init__ takes arguments must override this.
+        return self.__class__, ()
+
     def _pre_NON_PRINTABLE(self, text: str) -> str:
         return text.translate(self._non_printable_table)
 
@@ -174,22 +421,31 @@ class DefaultRenderer(Renderer):
 
     def _transform_TABLE(self, match: Match) -> str:
         rows = self._table_row_split.split(match['TABLE'])
-        output = '<table>'
+        output = ['<table>']
         if match['TABLE_HAS_HEADER']:
-            row = rows.pop(0)
-            output += '<thead><tr>'
-            for cell in self._pipe_split.split(row)[1:-1]:
-                output += f'<th>{self._parse(cell, "TABLE")}</th>'
-            output += '</tr></thead>'
-        if not rows: return output + '</table>'
-
-        output += '<tbody>'
+            output.append('<thead><tr>')
+            self._render_TABLE_row(rows.pop(0), '<th>', '</th>', output)
+            output.append('</tr></thead>')
+        if not rows:
+            output.append('</table>')
+            return ''.join(output)
+
+        output.append('<tbody>')
         for row in rows:
-            output += '<tr>'
-            for cell in self._pipe_split.split(row)[1:-1]:
-                output += f'<td>{self._parse(cell, "TABLE")}</td>'
-            output += '</tr>'
-        return output + '</tbody></table>'
+            output.append('<tr>')
+            self._render_TABLE_row(row, '<td>', '</td>', output)
+            output.append('</tr>')
+        output.append('</tbody></table>')
+        return ''.join(output)
+
+    def _render_TABLE_row(self, row: str, open_tag: str, close_tag: str, output: list) -> None:
+        """Appends the cells of one table row to output, only parsing cells that contain an opener of a TABLE rule."""
+        cells = self._pipe_split.split(row) if '\\' in row else row.split('|')
+        for cell in cells[1:-1]:
+            if self._table_cell_trigger_re.search(cell): cell = self._parse(cell, 'TABLE')
+            output.append(open_tag)
+            output.append(cell)
+            output.append(close_tag)
 
     def _transform_BULLET_LIST(self, match: Match) -> str:
         rows = [(len(m[0]), self._parse(m[1], 'BULLET_LIST')) for m in self._bullet_list_split_re.findall(match[0])]
@@ -260,6 +516,31 @@ class DefaultRenderer(Renderer):
 
 d = DefaultRenderer()
 
+WARM_UP_SAMPLES = (
+    '= Heading with @mention and :+1:\n'
+    '**bold //italics __underline --striked ^^sup^^ ~~sub~~ striked-- underline__ italics// bold**\n'
+    '{{{code}}} \\*\\* :not_an_emoji:\n'
+    '=|header|cells|\n|with **bold**|and :100:|\n'
+    '* bullet\n** nested bullet\n'
+    '# number\n## nested number\n'
+    '----',
+    '|plain|table|\n|without|triggers|',
+    'plain text & <html> "quotes"\r\n\x07with control characters',
+)
+
+def warm_up(renderer: Optional[Renderer] = None,
+            samples: Iterable[str] = WARM_UP_SAMPLES,
+            freeze: bool = True) -> Renderer:
+    """Runs every render path of renderer (d by default) once so that its regexes, emoji table and code objects are
+    loaded, then moves everything allocated so far into the permanent GC generation with gc.freeze(). Call it in the
+    master process before forking workers so that they share those pages copy-on-write."""
+    if renderer is None: renderer = d
+    for sample in samples: renderer.compile(sample)
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return renderer
+
 if __name__ == '__main__':
     from line_profiler import LineProfiler
 
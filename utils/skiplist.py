@@ -0,0 +1,154 @@
+import random
+from bisect import bisect_left, insort
+from typing import Any, Iterator, List, Optional
+
+_random = random.Random()  # Shared by every list: a Random of its own costs each one 2.5 KB
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key: Any, levels: int) -> None:
+        self.key = key
+        self.next: List[Optional[_Node]] = [None] * levels
+        self.width = [1] * levels
+
+class IndexableSkiplist:
+    """Sorted list of unique keys with O(log n) insert, remove, rank and lookup by position (skiplist with link widths).
+
+    Up to small_size keys are kept in a plain sorted list instead, which takes less memory and is as fast at that size.
+    The skiplist then gets one level more every time its size doubles, up to max_levels.
+    """
+    __slots__ = ('max_levels', 'levels', '_keys', '_head', '_size', '_random')
+    small_size = 64
+
+    def __init__(self, max_levels: int = 32, rng: Optional[random.Random] = None) -> None:
+        self.max_levels = max_levels
+        self.levels = 0
+        self._keys = []  # Sorted keys while small, None once they moved to the skiplist
+        self._head = None
+        self._size = 0
+        self._random = (rng or _random).random
+
+    def _promote(self) -> None:
+        keys, self._keys = self._keys, None
+        self._head, self.levels, self._size = _Node(None, 1), 1, 0
+        for key in keys: self.insert(key)
+
+    def _grow(self) -> None:
+        """Adds a level on top, empty for now: its head link spans the whole list"""
+        self._head.next.append(None)
+        self._head.width.append(self._size + 1)
+        self.levels += 1
+
+    def _find(self, key: Any):
+        """Last node before key on every level, and the position of each of those nodes"""
+        chain, positions = [None] * self.levels, [0] * self.levels
+        node, position = self._head, 0
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level], positions[level] = node, position
+        return chain, positions
+
+    def insert(self, key: Any) -> None:
+        if self._keys is not None:
+            if len(self._keys) < self.small_size:
+                insort(self._keys, key)
+                self._size += 1
+                return
+            self._promote()
+        if self._size >> self.levels and self.levels < self.max_levels: self._grow()
+        chain, positions = self._find(key)
+        levels = 1
+        while levels < self.levels and self._random() < 0.5: levels += 1
+        new_node = _Node(key, levels)
+        for level in range(levels):
+            previous = chain[level]
+            steps = positions[0] - positions[level]
+            new_node.next[level], previous.next[level] = previous.next[level], new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+        for level in range(levels, self.levels): chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any) -> None:
+        if self._keys is not None:
+            position = bisect_left(self._keys, key)
+            if position == len(self._keys) or self._keys[position] != key: raise KeyError(key)
+            del self._keys[position]
+            self._size -= 1
+            return
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key: raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.levels): chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key: Any) -> int:
+        """Zero-based rank of key"""
+        if self._keys is not None:
+            position = bisect_left(self._keys, key)
+            if position == len(self._keys) or self._keys[position] != key: raise KeyError(key)
+            return position
+        chain, positions = self._find(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key: raise KeyError(key)
+        return positions[0]
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0: index += self._size
+        if not 0 <= index < self._size: raise IndexError(index)
+        if self._keys is not None: return self._keys[index]
+        node, remaining = self._head, index + 1
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node.key
+
+    def islice(self, start: int, stop: Optional[int] = None) -> Iterator[Any]:
+        """Keys from position start (O(log n) to find) up to stop"""
+        if stop is None or stop > self._size: stop = self._size
+        if start < 0 or start >= stop: return
+        if self._keys is not None:
+            yield from self._keys[start:stop]
+            return
+        node, remaining = self._head, start + 1
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        for _ in range(stop - start):
+            yield node.key
+            node = node.next[0]
+
+    def __contains__(self, key: Any) -> bool:
+        if self._keys is not None:
+            position = bisect_left(self._keys, key)
+            return position < len(self._keys) and self._keys[position] == key
+        chain, _ = self._find(key)
+        node = chain[0].next[0]
+        return node is not None and node.key == key
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._keys is not None:
+            yield from self._keys
+            return
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({list(self)!r})'